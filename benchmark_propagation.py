@@ -0,0 +1,90 @@
+import argparse
+import os
+import random
+import time
+
+import networkx as nx
+
+from btcm.bt.btstate import BTStateManager
+from btcm.cm.causalmodel import PropagationSchedule
+from btcm.examples.random.random_domain import reconstruct_random_tree,make_state,state_class
+
+def intervened_graph(model,graph:nx.DiGraph,nodes:list[str]) -> nx.DiGraph:
+    # Same graph surgery as CausalModel.intervene
+    new_graph = nx.DiGraph(graph)
+    for node in nodes:
+        for parent in model.parents(node):
+            if parent in new_graph.nodes:
+                new_graph.remove_edge(parent,node)
+    return new_graph
+
+def valid_order(order:list[str],graph:nx.DiGraph) -> bool:
+    position = {node:i for i,node in enumerate(order)}
+    return all(position[u] < position[v] for u,v in graph.edges if u in position and v in position)
+
+if __name__ == "__main__":
+    '''
+    Parse Arguments
+    '''
+    parser = argparse.ArgumentParser(description="Compare the propagation schedule with the original propagation order on the random domain logs")
+    parser.add_argument('--directory', type=str, default="logs/random")
+    parser.add_argument('--num_logs', type=int, default=20)
+    parser.add_argument('--num_interventions', type=int, default=100, help="Intervention sets sampled per log")
+    parser.add_argument('--max_size', type=int, default=3, help="Maximum number of intervened variables")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    files = sorted(f for f in os.listdir(args.directory) if f.endswith(".json") and f.split("_")[1] == "default")
+    files = rng.sample(files,min(args.num_logs,len(files)))
+
+    '''
+    Benchmark
+    '''
+    total_reference = 0
+    total_schedule = 0
+    total_compile = 0
+    print(f"{'log':<60} {'nodes':>6} {'edges':>6} {'compile ms':>11} {'original ms':>12} {'schedule ms':>12} {'speedup':>8}")
+    for file in files:
+        manager = BTStateManager(
+            file,
+            directory=args.directory,
+            reconstruct_func=reconstruct_random_tree,
+            make_state_func=make_state,
+            state_class_func=state_class,
+            no_env=True,
+        )
+        model = manager.model
+        graph = model.graph
+        candidates = [node for node in graph.nodes if model.state.can_intervene(node)]
+
+        start = time.perf_counter()
+        schedule = PropagationSchedule(graph)
+        compile_time = time.perf_counter() - start
+
+        reference_time = 0
+        schedule_time = 0
+        for _ in range(args.num_interventions):
+            nodes = rng.sample(candidates,rng.randint(1,min(args.max_size,len(candidates))))
+            new_graph = intervened_graph(model,graph,nodes)
+
+            start = time.perf_counter()
+            reference = model.propagation_order(nodes,new_graph)
+            reference_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            order = schedule.propagation_order(nodes)
+            schedule_time += time.perf_counter() - start
+
+            if set(order) != set(reference) or not valid_order(order,new_graph):
+                raise RuntimeError(f"Propagation order mismatch for {nodes} in {file}")
+
+        total_reference += reference_time
+        total_schedule += schedule_time
+        total_compile += compile_time
+        print(f"{file:<60} {len(graph.nodes):>6} {len(graph.edges):>6} {compile_time*1000:>11.2f} {reference_time*1000/args.num_interventions:>12.3f} {schedule_time*1000/args.num_interventions:>12.4f} {reference_time/schedule_time:>7.0f}x")
+
+    num = args.num_interventions*len(files)
+    print(f"\nOriginal: {total_reference*1000/num:.3f} ms per intervention")
+    print(f"Schedule: {total_schedule*1000/num:.4f} ms per intervention, plus {total_compile*1000/len(files):.2f} ms to compile per graph")
+    print(f"Speedup: {total_reference/total_schedule:.0f}x")
@@ -3,6 +3,7 @@ import networkx as nx
 import json
 import importlib
 import copy
+import bisect
 
 from networkx.drawing.nx_pydot import graphviz_layout
 import matplotlib.pyplot as plt
@@ -14,6 +15,10 @@ from btcm.dm.state import State,VarRange
 from btcm.dm.action import NullAction
 from btcm.cm.causalmodel import CausalModel,CausalNode
 from btcm.bt.nodes import Leaf
+from btcm.bt.logger import read_log_stream
+from btcm.bt.columnar_log import ColumnarLog
+from btcm.bt.log_signature import StepSignature,step_signature
+from btcm.bt import model_cache
 from btcm.dm.environment import Environment
 
 '''
@@ -354,7 +359,7 @@ class BTState(State):
                         var_state.set_value(self.node_names[var],self.get_value(var))
 
             # Execute the behaviour
-            behaviour.execute(var_state,decision)
+            behaviour.cached_execute(var_state,decision)
 
             # Extract the new value
             new_val = var_state.get_value(self.node_names[node])
@@ -381,10 +386,10 @@ class BTState(State):
         if node_cat == "Action":
             corresponding_decision = self.sub_vars[self.nodes[node]]["Decision"]
             action = self.vals[corresponding_decision]
-            status = behaviour.execute(var_state,action)
+            status = behaviour.cached_execute(var_state,action)
         elif node_cat == "Condition":
             action = NullAction()
-            status = behaviour.execute(var_state,action)
+            status = behaviour.cached_execute(var_state,action)
         elif node_cat == "Sequence":
             children  = behaviour.children
             child_nodes = [self.behaviours_to_node[child] for child in children]
@@ -443,7 +448,7 @@ class BTState(State):
             return NullAction()
 
         behaviour:Leaf = self.behaviour_dict[self.nodes[node]]
-        decision = behaviour.decide(var_state)
+        decision = behaviour.cached_decide(var_state)
         return decision
     
     '''
@@ -478,6 +483,9 @@ class BTStateManager:
             make_state_func:Callable=None,
             state_class_func:Callable=None,
             no_env:bool = False,
+            checkpoint_interval:int = 50,
+            model_cache_dir:str = None,
+            template:"BTTemplate" = None,
         ):
         self.filename = filename
         self.directory = directory
@@ -485,8 +493,22 @@ class BTStateManager:
         # Flags
         self.no_env = no_env
 
+        # Replay checkpoints, saved every checkpoint_interval steps (None to disable)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = {}
+        self.checkpoint_positions = [] # Positions of the checkpoints, in order
+        self.history_writes = [] # History entries written since the last checkpoint the replay passed
+        self.resume_point = None # Replay state just after the last loaded step, to continue from for later steps
+
         # Read Data
         self.read_from_file()
+        self.index_steps()
+        self.signature = None # Step signature of the log, computed when first compared
+
+        if template is not None:
+            # Reuse the BT and causal model of the template, only keeping the data and replay state of this log
+            self.attach_template(template,dummy_env)
+            return
 
         # Reconstruct BT
         self.behaviours = {} # Stores mapping from node id string to behaviour object
@@ -512,8 +534,9 @@ class BTStateManager:
             state_class_func,
             )
 
-        # Create causal model
-        self.model,self.state_batches = self.create_causal_model(causal_edges)
+        # Create causal model, node inputs and the static lookups used when replaying the log
+        self.model_cache_dir = model_cache_dir
+        self.compile_model(causal_edges)
 
         # Get node names
         self.node_names = self.get_node_name_dict()
@@ -521,21 +544,126 @@ class BTStateManager:
         # Register blackboard
         self.board = self.register_blackboard(data=self.data,state=self.state,env=dummy_env)
 
-        # Create node inputs
-        self.node_to_inputs = self.create_node_inputs()
-
         # Inject node to inputs dict to the BTstate
         self.state.node_to_inputs = self.node_to_inputs
 
+        self.root_return = self.state.sub_vars[self.behaviours_to_nodes[self.tree.root]]["Return"]
+
+
+    def attach_template(self,template:"BTTemplate",dummy_env:Environment):
+        self.share_tree(template)
+
+        self.graph = template.graph
+        self.tree = template.tree
+        self.behaviours = template.behaviours
+        self.behaviours_to_nodes = template.behaviours_to_nodes
+        self.make_state_func = template.make_state_func
+        self.state_class_func = template.state_class_func
+        self.model_cache_dir = None
+
+        # Own state values over the shared state variables
+        self.state = BTState.copy_state(template.state)
+
+        # Own causal model over the shared graph and nodes, so interventions copy this log's state
+        self.model = CausalModel(self.state)
+        self.model.nodes = template.model.nodes
+        self.model.graph = template.model.graph
+
+        self.state_batches = template.state_batches
+        self.node_to_inputs = template.node_to_inputs
+        self.update_plans = template.update_plans
+        self.var_chains = template.var_chains
+        self.node_names = template.node_names
+        self.root_return = template.root_return
+
+        self.board = self.register_blackboard(data=self.data,state=self.state,env=dummy_env)
+
+    def share_tree(self,template:"BTTemplate"):
+        '''
+        Check that the log was produced by the template tree and replace its tree with the template's,
+        renaming nodes if the log uses different node ids
+        '''
+        node_ids = model_cache.canonical_node_ids(self.data["tree"])
+        if model_cache.canonical_tree(self.data["tree"],node_ids) != template.canonical_tree or self.data["state"] != template.header["state"]:
+            raise ValueError(f"Log {self.filename} was not produced by the same tree as the template")
+
+        template_ids = {canonical:node for node,canonical in template.node_ids.items()}
+        node_map = {node:template_ids[canonical] for node,canonical in node_ids.items()}
+
+        if isinstance(self.data,ColumnarLog):
+            self.data.rename_nodes(node_map,template.header["tree"])
+            return
+
+        self.data["tree"] = template.header["tree"]
+        if any(node != node_map[node] for node in node_map):
+            for tick,time in self.steps:
+                step = self.data[str(tick)][str(time)]
+                if "update" in step:
+                    step["update"] = {node_map[node]:update for node,update in step["update"].items()}
 
     def read_from_file(self):
         if self.directory == "":
             filepath = self.filename
         else:
             filepath = f"{self.directory}/{self.filename}"
+        if filepath.endswith(".jsonl"):
+            # Append-only log written by a streaming logger
+            self.data = read_log_stream(filepath)
+            return
+        if filepath.endswith(".btlog"):
+            # Memory mapped columnar log
+            self.data = ColumnarLog(filepath)
+            return
         with open(filepath, 'r') as file:
             self.data = json.load(file)
 
+    def index_steps(self):
+        '''
+        Record the order of logged (tick, time) steps, used to rebuild delta-encoded states
+        '''
+        self.steps = []
+        self.step_positions = {}
+        for tick in sorted(int(key) for key in self.data if key.isdigit()):
+            for time in sorted(int(key) for key in self.data[str(tick)]):
+                self.step_positions[(tick,time)] = len(self.steps)
+                self.steps.append((tick,time))
+        self.snapshot_cache = None # (position, state) of the last rebuilt snapshot
+
+    def step_signature(self) -> StepSignature:
+        '''
+        Signature of the logged updates, used to compare this log with others
+        '''
+        if self.signature is None:
+            self.signature = step_signature(self.data)
+        return self.signature
+
+    def get_state_snapshot(self,tick:int,time:int) -> dict:
+        '''
+        Get the full logged state at a (tick, time), rebuilding it from the nearest keyframe if the log only stores deltas
+        '''
+        step = self.data[str(tick)][str(time)]
+        if "state" in step:
+            return step["state"]
+
+        position = self.step_positions[(int(tick),int(time))]
+        cache_position = self.snapshot_cache[0] if self.snapshot_cache is not None and self.snapshot_cache[0] <= position else -1
+
+        # Walk back to the nearest keyframe, or to the last rebuilt snapshot if that is closer
+        start = position
+        while start > cache_position and "state" not in self.data[str(self.steps[start][0])][str(self.steps[start][1])]:
+            start -= 1
+        if start == cache_position:
+            snapshot = dict(self.snapshot_cache[1])
+        else:
+            snapshot = dict(self.data[str(self.steps[start][0])][str(self.steps[start][1])]["state"])
+
+        # Apply deltas up to the requested step
+        for i in range(start+1,position+1):
+            snapshot.update(self.data[str(self.steps[i][0])][str(self.steps[i][1])]["delta"])
+
+        self.snapshot_cache = (position,snapshot)
+        return snapshot
+
     def reconstruct_bt(self):
         # Start by recovering the tree graph
         graph = nx.DiGraph()
@@ -730,20 +858,18 @@ class BTStateManager:
 
     def add_to_val_history(self,var:str,tick:int,time:int,value):
         var_name = self.state.node_names[var]
-        if var_name not in self.value_history:
-            self.value_history[var_name] = {str(tick):{str(time):value}}
-        elif str(tick) not in self.value_history[var_name]:
-            self.value_history[var_name][str(tick)] = {str(time):value}
-        else:
-            self.value_history[var_name][str(tick)][str(time)] = value
+        self.set_history(self.value_history,var_name,str(tick),str(time),value)
+        if self.checkpoint_interval is not None:
+            self.history_writes.append(("value",var_name,str(tick),str(time),value))
 
     def add_to_update_history(self,var:str,tick:int,time:int,value):
-        if var not in self.update_history:
-            self.update_history[var] = {str(tick):{str(time):value}}
-        elif str(tick) not in self.update_history[var]:
-            self.update_history[var][str(tick)] = {str(time):value}
-        else:
-            self.update_history[var][str(tick)][str(time)] = value
+        self.set_history(self.update_history,var,str(tick),str(time),value)
+        if self.checkpoint_interval is not None:
+            self.history_writes.append(("update",var,str(tick),str(time),value))
+
+    @staticmethod
+    def set_history(history:dict,var:str,tick:str,time:str,value):
+        history.setdefault(var,{}).setdefault(tick,{})[time] = value
 
     def load_state(self,tick:int=0,time="end"):
         if str(tick) not in self.data:
@@ -759,23 +885,21 @@ class BTStateManager:
 
         self.set_initial_state()
 
-        # Iterate through timesteps until current time
-        curr_tick = 0
-        curr_time = 0
+        # Iterate through timesteps until current time, continuing from the last loaded step or the latest checkpoint
+        # before it
+        position = self.step_positions[(int(tick),time)]
+        curr_tick,curr_time,last_state_time,reset_tree,node_updates = self.restore_checkpoint(position)
+        self.resume_point = None
         found_time = False
-        last_state_time = (0,0)
-        reset_tree = False
 
         dummy_state = self.make_dummy_state()
 
-        self.value_history = {}
-        self.update_history = {}
-
-        node_updates = {}
         while str(curr_tick) in self.data and not found_time:
             data_tick = self.data[str(curr_tick)]
             #curr_time = 0
             while str(curr_time) in data_tick and not found_time:
+                self.save_checkpoint(curr_tick,curr_time,last_state_time,reset_tree,node_updates)
+
                 if reset_tree:
                     self.set_initial_state(only_tree=True)
                     reset_tree = False
@@ -795,41 +919,32 @@ class BTStateManager:
 
                         node_updates[node] = update[node]["status"]!="Status.INVALID"
 
-                        if self.data["tree"][node]["category"] in ["Action","Condition"]:
+                        if node in self.update_plans:
                             # Update the states of input variables and their ancestors
-                            parents = self.model.parents(self.state.sub_vars[node]["Return"])
-                            parent_state_vars = [parent for parent in parents if self.state.categories[parent] == "State"]
-                            for parent in parent_state_vars:
-                                ancestors = list(nx.ancestors(self.model.graph, parent))
-                                state_ancestors = [anc for anc in ancestors if self.state.categories[anc] == "State"]
-                                same_batch_ancestors = [anc for anc in state_ancestors if self.state_batches[anc] == self.state_batches[parent]]
-                                vars_to_update = [parent] + same_batch_ancestors
-                                for var in vars_to_update:
-                                    # Check if already updated
-                                    if var in self.update_history:
-                                        already_updated = True if str(curr_tick) in self.update_history[var] else False
-                                    else:
-                                        already_updated = False
-
-                                    if already_updated:
-                                        continue
-                                    # Update var
-                                    data_tick_time = self.data[str(last_state_time[0])][str(last_state_time[1])] # Use t-1
-                                    self.state.set_value(var,data_tick_time["state"][self.state.node_names[var]])
-                                    self.add_to_val_history(var,last_state_time[0],last_state_time[1],data_tick_time["state"][self.state.node_names[var]])
-                                    self.add_to_update_history(var,last_state_time[0],last_state_time[1],data_tick_time["state"][self.state.node_names[var]])
+                            for var in self.update_plans[node]["inputs"]:
+                                # Check if already updated
+                                if var in self.update_history:
+                                    already_updated = True if str(curr_tick) in self.update_history[var] else False
+                                else:
+                                    already_updated = False
+
+                                if already_updated:
+                                    continue
+                                # Update var
+                                state_snapshot = self.get_state_snapshot(last_state_time[0],last_state_time[1]) # Use t-1
+                                self.state.set_value(var,state_snapshot[self.state.node_names[var]])
+                                self.add_to_val_history(var,last_state_time[0],last_state_time[1],state_snapshot[self.state.node_names[var]])
+                                self.add_to_update_history(var,last_state_time[0],last_state_time[1],state_snapshot[self.state.node_names[var]])
 
                             # Update the states of output variables
-                            children = [var for var in self.model.nodes if self.state.sub_vars[node]["Executed"] in self.model.parents(var)]
-                            children_state_vars = [child for child in children if self.state.categories[child] == "State"]
-                            for child in children_state_vars:
-                                data_tick_time = self.data[str(curr_tick)][str(curr_time)] # Use t
-                                self.state.set_value(child,data_tick_time["state"][self.state.node_names[child]])
-                                self.add_to_val_history(child,curr_tick,curr_time,data_tick_time["state"][self.state.node_names[child]])
-                                self.add_to_update_history(child,curr_tick,curr_time,data_tick_time["state"][self.state.node_names[child]])
+                            for child in self.update_plans[node]["outputs"]:
+                                state_snapshot = self.get_state_snapshot(curr_tick,curr_time) # Use t
+                                self.state.set_value(child,state_snapshot[self.state.node_names[child]])
+                                self.add_to_val_history(child,curr_tick,curr_time,state_snapshot[self.state.node_names[child]])
+                                self.add_to_update_history(child,curr_tick,curr_time,state_snapshot[self.state.node_names[child]])
 
                         # Check if we need to reset the tree
-                        root_node_status = self.state.get_value(self.state.sub_vars[self.behaviours_to_nodes[self.tree.root]]['Return'])
+                        root_node_status = self.state.get_value(self.root_return)
                         if root_node_status in [py_trees.common.Status.SUCCESS,py_trees.common.Status.FAILURE]:
                             # Reset the tree
                             reset_tree = True
@@ -843,6 +958,8 @@ class BTStateManager:
                 curr_time += 1
             curr_tick += 1
 
+        self.save_resume_point(position,last_state_time,reset_tree,node_updates)
+
         # Executed nodes
         for node in node_updates:
             self.state.set_value(self.state.sub_vars[node]["Executed"],node_updates[node])
@@ -855,25 +972,97 @@ class BTStateManager:
         # TODO: Update update times for all execution variables based on earliest executed child
 
         # Go through un-updated state variables and set their values based on previous iterations
-        var_chain = {}
-        for node in self.state.vars():
-            if self.state.categories[node] == "State":
-                node_name = self.state.node_names[node]
-                if node_name not in var_chain:
-                    var_chain[node_name] = [node]
-                else:
-                    var_chain[node_name].append(node)
-        
-        for var in var_chain:
-            var_chain[var] = sorted(var_chain[var])
+        for var in self.var_chains:
             last_val = None
-            for var_x in var_chain[var]:
+            for var_x in self.var_chains[var]:
                 if self.state.get_value(var_x) is None and last_val is not None:
                     self.state.set_value(var_x,last_val)
                 else:
                     last_val = self.state.get_value(var_x)
             
         
+    '''
+    CHECKPOINTS
+    '''
+    def save_checkpoint(self,tick:int,time:int,last_state_time:tuple[int,int],reset_tree:bool,node_updates:dict):
+        '''
+        Save the replay state before the update at (tick, time) is applied. Checkpoints only hold the history entries
+        written since the previous checkpoint, so their memory grows linearly with the log, and restoring one writes
+        the entries of every checkpoint up to it in order
+        '''
+        if self.checkpoint_interval is None:
+            return
+        position = self.step_positions[(tick,time)]
+        if position == 0 or position % self.checkpoint_interval != 0:
+            return
+
+        if position not in self.checkpoints:
+            self.checkpoints[position] = {
+                "tick":tick,
+                "time":time,
+                "vals":self.written_vals(),
+                "history_writes":self.history_writes,
+                "node_updates":dict(node_updates),
+                "last_state_time":last_state_time,
+                "reset_tree":reset_tree,
+            }
+            bisect.insort(self.checkpoint_positions,position)
+        # The replay always passes the previous checkpoint, so the next checkpoint's entries start here
+        self.history_writes = []
+
+    def save_resume_point(self,position:int,last_state_time:tuple[int,int],reset_tree:bool,node_updates:dict):
+        '''
+        Save the replay state after the step at the given position is applied, so a later step is loaded by only
+        replaying the steps between them. The histories are left as they are rather than copied
+        '''
+        if self.checkpoint_interval is None or position+1 >= len(self.steps):
+            return
+        tick,time = self.steps[position+1]
+        self.resume_point = {
+            "position":position+1,
+            "tick":tick,
+            "time":time,
+            "vals":self.written_vals(),
+            "node_updates":dict(node_updates),
+            "last_state_time":last_state_time,
+            "reset_tree":reset_tree,
+        }
+
+    def written_vals(self) -> dict:
+        # Only keep values written by the replay, other values are left as they are when restoring
+        written = [var for var in self.state.vals if self.state.categories[var] != "State" or var in self.update_history or var == f"{self.state.node_names[var]}_0"]
+        return {var:self.state.vals[var] for var in written}
+
+    def restore_checkpoint(self,position:int) -> tuple[int,int,tuple[int,int],bool,dict]:
+        '''
+        Restore the replay state to continue from for the given step position, returning the replay loop variables.
+        This is the point after the last loaded step if that is not after the position and at most one checkpoint
+        interval before it or after the latest checkpoint, otherwise the latest checkpoint at or before the position
+        '''
+        index = bisect.bisect_right(self.checkpoint_positions,position)
+        resume = self.resume_point
+        if resume is not None and resume["position"] <= position and (
+            position - resume["position"] <= self.checkpoint_interval or index == 0 or self.checkpoint_positions[index-1] <= resume["position"]
+        ):
+            # The histories already hold every entry up to the resume point
+            self.state.vals.update(resume["vals"])
+            return resume["tick"],resume["time"],resume["last_state_time"],resume["reset_tree"],dict(resume["node_updates"])
+
+        self.value_history = {}
+        self.update_history = {}
+        self.history_writes = []
+        if index == 0:
+            return 0,0,(0,0),False,{}
+
+        histories = {"value":self.value_history,"update":self.update_history}
+        for pos in self.checkpoint_positions[:index]:
+            for name,var,tick,time,value in self.checkpoints[pos]["history_writes"]:
+                histories[name].setdefault(var,{}).setdefault(tick,{})[time] = value
+
+        checkpoint = self.checkpoints[self.checkpoint_positions[index-1]]
+        self.state.vals.update(checkpoint["vals"])
+        return checkpoint["tick"],checkpoint["time"],checkpoint["last_state_time"],checkpoint["reset_tree"],dict(checkpoint["node_updates"])
+
     def update_parent_executions(self,node):
         # Update node
         self.state.set_value(self.state.sub_vars[node]["Executed"],True)
@@ -885,11 +1074,11 @@ class BTStateManager:
 
     def set_initial_state(self,only_tree=False):
         if not only_tree:
-            data0 = self.data["0"]["0"]
+            state0 = self.get_state_snapshot(0,0)
 
             # Set State Variables
-            for state_var in data0["state"]:
-                self.state.set_value(f"{state_var}_0",data0["state"][state_var])
+            for state_var in state0:
+                self.state.set_value(f"{state_var}_0",state0[state_var])
         
         # Set behaviour tree node values
         for node in self.state.sub_vars:
@@ -934,6 +1123,47 @@ class BTStateManager:
 
         return node_to_inputs
 
+    def create_update_plans(self) -> dict[str,dict[str,list[str]]]:
+        '''
+        For every leaf, list the state variables to read from the log when it is updated:
+            inputs - the input variables of the leaf and their ancestors in the same batch, read at t-1
+            outputs - the variables the leaf writes to, read at t
+        '''
+        update_plans = {}
+        for node in self.state.sub_vars:
+            if self.data["tree"][node]["category"] not in ["Action","Condition"]:
+                continue
+
+            inputs = []
+            parents = self.model.parents(self.state.sub_vars[node]["Return"])
+            parent_state_vars = [parent for parent in parents if self.state.categories[parent] == "State"]
+            for parent in parent_state_vars:
+                ancestors = list(nx.ancestors(self.model.graph, parent))
+                state_ancestors = [anc for anc in ancestors if self.state.categories[anc] == "State"]
+                same_batch_ancestors = [anc for anc in state_ancestors if self.state_batches[anc] == self.state_batches[parent]]
+                inputs += [parent] + same_batch_ancestors
+
+            executed = self.state.sub_vars[node]["Executed"]
+            children = list(self.model.graph.successors(executed))
+            outputs = [var for var in self.model.nodes if var in children and self.state.categories[var] == "State"]
+
+            update_plans[node] = {"inputs":inputs,"outputs":outputs}
+        return update_plans
+
+    def create_var_chains(self) -> dict[str,list[str]]:
+        '''
+        Map every state variable name to the causal model variables representing it over time
+        '''
+        var_chains = {}
+        for node in self.state.vars():
+            if self.state.categories[node] == "State":
+                node_name = self.state.node_names[node]
+                if node_name not in var_chains:
+                    var_chains[node_name] = [node]
+                else:
+                    var_chains[node_name].append(node)
+        return {var:sorted(var_chains[var]) for var in var_chains}
+
     def create_state_graph(self,causal_edges:list[tuple[str,str]] = None):
         dummy_state = self.make_dummy_state()
         if causal_edges is None:
@@ -944,8 +1174,72 @@ class BTStateManager:
 
         return state_graph
     
+    def compile_model(self,causal_edges:list[tuple[str,str]] = None):
+        '''
+        Create the causal model, state batches, node inputs, update plans and variable chains, reusing a cached copy if possible
+        '''
+        key = None
+        if self.model_cache_dir is not None:
+            dummy_state = self.make_dummy_state()
+            edges = causal_edges if causal_edges is not None else dummy_state.cm_edges()
+            leaves = {self.behaviours_to_nodes[leaf]:leaf for leaf in self.get_leaf_behaviours(self.tree.root)}
+            node_ids = model_cache.canonical_node_ids(self.data["tree"])
+            key = model_cache.cache_key(self.data,node_ids,leaves,dummy_state,edges)
+
+            entry = model_cache.load_compiled_model(self.model_cache_dir,key)
+            if entry is not None:
+                # Translate from canonical ids back to the ids used in this log
+                actual_ids = {canonical:node for node,canonical in node_ids.items()}
+                self.restore_compiled_model(model_cache.rename_entry(entry,model_cache.renaming(actual_ids)),dummy_state)
+                return
+
+        self.model,self.state_batches = self.create_causal_model(causal_edges)
+        self.node_to_inputs = self.create_node_inputs()
+        self.update_plans = self.create_update_plans()
+        self.var_chains = self.create_var_chains()
+
+        if key is not None:
+            entry = model_cache.rename_entry(self.compiled_model_entry(),model_cache.renaming(node_ids))
+            model_cache.save_compiled_model(self.model_cache_dir,key,entry)
+
+    def compiled_model_entry(self) -> dict:
+        return {
+            "state_vars":[(var,self.state.node_names[var]) for var in self.state.vars() if self.state.categories[var] == "State"],
+            "node_order":list(self.model.nodes.keys()),
+            "edges":list(self.model.graph.edges),
+            "state_batches":self.state_batches,
+            "node_to_inputs":self.node_to_inputs,
+            "update_plans":self.update_plans,
+            "var_chains":self.var_chains,
+        }
+
+    def restore_compiled_model(self,entry:dict,dummy_state:State):
+        # Recreate state variables, rebinding their functions to this manager's state
+        for vname,variable_name in entry["state_vars"]:
+            self.add_state_variable(vname,variable_name,dummy_state)
+
+        cm = CausalModel(self.state)
+        for var in entry["node_order"]:
+            cm.nodes[var] = CausalNode(
+                name=var,
+                vals=self.state.ranges()[var].values,
+                func=self.state.var_funcs()[var],
+                category=self.state.categories[var],
+                value=None
+            )
+        cm.graph = model_cache.entry_graph(entry)
+
+        self.model = cm
+        self.state_batches = entry["state_batches"]
+        self.node_to_inputs = entry["node_to_inputs"]
+        self.update_plans = entry["update_plans"]
+        self.var_chains = entry["var_chains"]
+
     def create_state_variable(self,variable_name:str,variable_counts:dict[str,int],dummy_state:State):
             vname = f"{variable_name}_{variable_counts[variable_name]}"
+            self.add_state_variable(vname,variable_name,dummy_state)
+
+    def add_state_variable(self,vname:str,variable_name:str,dummy_state:State):
             self.state.vars_list.append(vname)
             self.state.range_dict[vname] = self.state.discretise_range(dummy_state.ranges()[variable_name])
             self.state.func_dict[vname] = dummy_state.var_funcs()[variable_name]
@@ -1268,3 +1562,60 @@ class BTStateManager:
         
 
 
+
+
+class BTTemplate:
+    '''
+    The reconstructed BT, state variables and compiled causal model of a log, shared by every log produced by the same tree
+
+    Logs loaded from a template are BTStateManagers that reuse all of these, and only hold their own log data, state
+    values and replay history. Logs from other executions of the tree are accepted even if their node ids differ.
+    '''
+    def __init__(self,manager:BTStateManager):
+        # Only keep the log header, not the logged steps
+        self.header = {key:manager.data[key] for key in ["tree","state","environment"] if key in manager.data}
+        self.node_ids = model_cache.canonical_node_ids(self.header["tree"])
+        self.canonical_tree = model_cache.canonical_tree(self.header["tree"],self.node_ids)
+
+        self.graph = manager.graph
+        self.tree = manager.tree
+        self.behaviours = manager.behaviours
+        self.behaviours_to_nodes = manager.behaviours_to_nodes
+        self.make_state_func = manager.make_state_func
+        self.state_class_func = manager.state_class_func
+        self.no_env = manager.no_env
+
+        self.state = BTState.copy_state(manager.state)
+        self.state.data = self.header
+        self.state.vals = {var:None for var in self.state.vals}
+
+        self.model = CausalModel(self.state)
+        self.model.nodes = manager.model.nodes
+        self.model.graph = manager.model.graph
+
+        self.state_batches = manager.state_batches
+        self.node_to_inputs = manager.node_to_inputs
+        self.update_plans = manager.update_plans
+        self.var_chains = manager.var_chains
+        self.node_names = manager.node_names
+        self.root_return = manager.root_return
+
+    @classmethod
+    def from_file(cls,filename:str,**kwargs) -> Self:
+        '''
+        Build a template from a log, taking the same arguments as BTStateManager
+        '''
+        return cls(BTStateManager(filename,**kwargs))
+
+    def load(self,filename:str,directory:str="",dummy_env:Environment=None,checkpoint_interval:int=50) -> BTStateManager:
+        '''
+        Load a log produced by the template tree
+        '''
+        return BTStateManager(
+            filename,
+            dummy_env=dummy_env,
+            directory=directory,
+            no_env=self.no_env,
+            checkpoint_interval=checkpoint_interval,
+            template=self,
+        )
@@ -0,0 +1,249 @@
+import numpy as np
+import json
+from pathlib import Path
+from collections.abc import Mapping
+
+from btcm.bt.logger import read_log_stream
+
+'''
+Columnar episodic memory
+
+A columnar log is a directory (by convention ending in .btlog) holding:
+    header.json     - the tree, state and environment information from the original log, plus column metadata
+    steps.npy       - (tick, time) for every logged step, in order
+    ticks.npy       - (tick, first step, last step + 1) for every tick
+    update_*.npy    - the node, status and action of the update at every step (-1 if there is no update)
+    var_*.npy       - one column per state variable
+
+State variables that are all booleans, all integers or all floats are stored natively. Anything else
+(strings, mixed types, lists, ...) is dictionary encoded, storing an integer code per step and the
+distinct values in the header. All columns are memory mapped when read, so opening a log only reads
+the header and queries only touch the pages for the steps being accessed.
+'''
+
+def column_encoding(values:list) -> dict:
+    '''
+    Choose how to store a column of state values
+    '''
+    if all(type(val) is bool for val in values):
+        return {"dtype":"bool"}
+    if all(type(val) is int for val in values):
+        return {"dtype":"int64"}
+    if all(type(val) is float for val in values):
+        return {"dtype":"float64"}
+
+    # Dictionary encoding, keeping the first occurrence of every distinct value
+    distinct = {}
+    for val in values:
+        key = json.dumps(val, sort_keys=True)
+        if key not in distinct:
+            distinct[key] = val
+    return {"dtype":"dict","values":list(distinct.values())}
+
+def write_columnar_log(data:dict,directory:str):
+    '''
+    Write a log dictionary (as read from a json or jsonl log) to a columnar log directory
+    '''
+    path = Path(directory)
+    path.mkdir(exist_ok=True, parents=True)
+
+    # Ordered steps
+    steps = []
+    for tick in sorted(int(key) for key in data if key.isdigit()):
+        for time in sorted(int(key) for key in data[str(tick)]):
+            steps.append((tick,time))
+
+    # Rebuild full states, applying deltas if the log is delta-encoded
+    states = []
+    last_state = None
+    for tick,time in steps:
+        step = data[str(tick)][str(time)]
+        if "state" in step:
+            last_state = dict(step["state"])
+        else:
+            last_state = dict(last_state)
+            last_state.update(step["delta"])
+        states.append(last_state)
+
+    # Tick index
+    ticks = []
+    for i,(tick,time) in enumerate(steps):
+        if len(ticks) == 0 or ticks[-1][0] != tick:
+            ticks.append([tick,i,i+1])
+        else:
+            ticks[-1][2] = i+1
+
+    # Updates
+    nodes = list(data["tree"].keys())
+    statuses = []
+    actions = []
+    update_node = np.full(len(steps),-1,dtype=np.int32)
+    update_status = np.full(len(steps),-1,dtype=np.int32)
+    update_action = np.full(len(steps),-1,dtype=np.int32)
+    for i,(tick,time) in enumerate(steps):
+        step = data[str(tick)][str(time)]
+        if "update" not in step:
+            continue
+        if len(step["update"]) != 1:
+            raise ValueError(f"Expected a single update at timestep {tick}-{time}")
+        node = list(step["update"].keys())[0]
+        update = step["update"][node]
+        update_node[i] = nodes.index(node)
+        if update["status"] not in statuses:
+            statuses.append(update["status"])
+        update_status[i] = statuses.index(update["status"])
+        if "action" in update:
+            if update["action"] not in actions:
+                actions.append(update["action"])
+            update_action[i] = actions.index(update["action"])
+
+    # State columns
+    variables = list(states[0].keys()) if len(states) > 0 else []
+    encodings = {}
+    for j,var in enumerate(variables):
+        values = [state[var] for state in states]
+        encoding = column_encoding(values)
+        if encoding["dtype"] == "dict":
+            codes = {json.dumps(val, sort_keys=True):k for k,val in enumerate(encoding["values"])}
+            column = np.array([codes[json.dumps(val, sort_keys=True)] for val in values],dtype=np.int32)
+        else:
+            column = np.array(values,dtype=encoding["dtype"])
+        np.save(path / f"var_{j}.npy",column)
+        encodings[var] = encoding
+
+    np.save(path / "steps.npy",np.array(steps,dtype=np.int64).reshape(-1,2))
+    np.save(path / "ticks.npy",np.array(ticks,dtype=np.int64).reshape(-1,3))
+    np.save(path / "update_node.npy",update_node)
+    np.save(path / "update_status.npy",update_status)
+    np.save(path / "update_action.npy",update_action)
+
+    header = {
+        "log":{key:data[key] for key in data if not key.isdigit()},
+        "columns":{
+            "variables":variables,
+            "encodings":encodings,
+            "nodes":nodes,
+            "statuses":statuses,
+            "actions":actions,
+        },
+    }
+    with open(path / "header.json", 'w') as f:
+        json.dump(header, f, indent=4)
+
+def convert_log(filepath:str,directory:str=None) -> str:
+    '''
+    Convert a json or jsonl log to a columnar log, by default next to the original with a .btlog extension
+    '''
+    if filepath.endswith(".jsonl"):
+        data = read_log_stream(filepath)
+    else:
+        with open(filepath, 'r') as file:
+            data = json.load(file)
+
+    if directory is None:
+        directory = str(Path(filepath).with_suffix(".btlog"))
+    write_columnar_log(data,directory)
+    return directory
+
+class ColumnarLog(Mapping):
+    '''
+    Read-only, memory mapped view of a columnar log that behaves like the nested log dictionary,
+    i.e. log["tree"], log[str(tick)][str(time)]["update"] and log[str(tick)][str(time)]["state"]
+    '''
+    def __init__(self,directory:str):
+        self.path = Path(directory)
+        with open(self.path / "header.json", 'r') as f:
+            header = json.load(f)
+        self.header = header["log"]
+        self.columns = header["columns"]
+
+        self.steps = np.load(self.path / "steps.npy",mmap_mode="r")
+        self.update_node = np.load(self.path / "update_node.npy",mmap_mode="r")
+        self.update_status = np.load(self.path / "update_status.npy",mmap_mode="r")
+        self.update_action = np.load(self.path / "update_action.npy",mmap_mode="r")
+        self.vars = {
+            var:np.load(self.path / f"var_{j}.npy",mmap_mode="r") for j,var in enumerate(self.columns["variables"])
+        }
+
+        # The tick index is small, so it is read in full
+        self.ticks = {str(row[0]):(int(row[1]),int(row[2])) for row in np.load(self.path / "ticks.npy").tolist()}
+        self.tick_views = {}
+        self.last_step = (None,None) # (index, step) of the last rebuilt step
+
+    def __getitem__(self,key:str):
+        if key in self.header:
+            return self.header[key]
+        if key in self.ticks:
+            if key not in self.tick_views:
+                self.tick_views[key] = ColumnarTick(self,*self.ticks[key])
+            return self.tick_views[key]
+        raise KeyError(key)
+
+    def __contains__(self,key):
+        return key in self.header or key in self.ticks
+
+    def __iter__(self):
+        yield from self.header
+        yield from self.ticks
+
+    def __len__(self):
+        return len(self.header) + len(self.ticks)
+
+    def rename_nodes(self,node_map:dict[str,str],tree:dict):
+        '''
+        Refer to nodes by different ids, replacing the logged tree with an equivalent one using those ids
+        '''
+        self.header["tree"] = tree
+        self.columns["nodes"] = [node_map[node] for node in self.columns["nodes"]]
+        self.last_step = (None,None)
+
+    def step(self,index:int) -> dict:
+        '''
+        Rebuild the logged step at a row index
+        '''
+        if self.last_step[0] == index:
+            return self.last_step[1]
+
+        step = {}
+        node_code = int(self.update_node[index])
+        if node_code >= 0:
+            node = self.columns["nodes"][node_code]
+            update = {
+                "name":self.header["tree"][node]["name"],
+                "status":self.columns["statuses"][int(self.update_status[index])],
+            }
+            action_code = int(self.update_action[index])
+            if action_code >= 0:
+                update["action"] = self.columns["actions"][action_code]
+            step["update"] = {node:update}
+        step["state"] = {var:self.value(var,index) for var in self.vars}
+        self.last_step = (index,step)
+        return step
+
+    def value(self,var:str,index:int):
+        encoding = self.columns["encodings"][var]
+        if encoding["dtype"] == "dict":
+            return encoding["values"][int(self.vars[var][index])]
+        return self.vars[var][index].item()
+
+class ColumnarTick(Mapping):
+    '''
+    View of the steps of a single tick in a columnar log
+    '''
+    def __init__(self,log:ColumnarLog,start:int,end:int):
+        self.log = log
+        self.start = start
+        self.end = end
+        self.times = {str(int(self.log.steps[i][1])):i for i in range(start,end)}
+
+    def __getitem__(self,key:str) -> dict:
+        return self.log.step(self.times[key])
+
+    def __contains__(self,key):
+        return key in self.times
+
+    def __iter__(self):
+        return iter(self.times)
+
+    def __len__(self):
+        return len(self.times)
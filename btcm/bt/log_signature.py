@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import numpy as np
+from collections.abc import Mapping
+
+from btcm.bt.columnar_log import ColumnarLog
+
+'''
+Step signatures of logs
+
+A step signature holds the (tick, time) of every logged step with an update, and a code for each compared field of
+the update (the name, status and action of the updated node). Codes are stable hashes of the field values, so the
+signatures of different logs can be compared directly, and fields missing from an update are coded as MISSING.
+Comparing two logs is then a vectorised comparison of their signatures over the steps both logs share, rather than
+a walk through both logs comparing update dictionaries.
+'''
+
+FIELDS = ["name","status","action"]
+MISSING = 0
+
+@functools.lru_cache(maxsize=None)
+def field_code(value:str) -> int:
+    code = int.from_bytes(hashlib.blake2b(str(value).encode(),digest_size=8).digest(),"little",signed=True)
+    return code if code != MISSING else 1
+
+class StepSignature:
+    def __init__(self,steps:np.ndarray,codes:np.ndarray):
+        self.steps = steps # (tick, time) of every step with an update, in order
+        self.codes = codes # Code of every field of the update at every step
+
+    def __len__(self):
+        return len(self.steps)
+
+def step_signature(data:Mapping) -> StepSignature:
+    '''
+    Signature of a log dictionary, or of a columnar log without rebuilding its steps
+    '''
+    if isinstance(data,ColumnarLog):
+        return columnar_step_signature(data)
+
+    steps = []
+    codes = []
+    for tick in sorted(int(key) for key in data if key.isdigit()):
+        tick_data = data[str(tick)]
+        for time in sorted(int(key) for key in tick_data):
+            step = tick_data[str(time)]
+            if "update" not in step:
+                continue
+            update = next(iter(step["update"].values()))
+            steps.append((tick,time))
+            codes.append([field_code(update[field]) if field in update else MISSING for field in FIELDS])
+    return StepSignature(
+        np.array(steps,dtype=np.int64).reshape(-1,2),
+        np.array(codes,dtype=np.int64).reshape(-1,len(FIELDS)),
+    )
+
+def columnar_step_signature(log:ColumnarLog) -> StepSignature:
+    rows = np.flatnonzero(np.asarray(log.update_node) >= 0)
+    tree = log.header["tree"]
+    tables = [
+        np.array([field_code(tree[node]["name"]) for node in log.columns["nodes"]],dtype=np.int64),
+        np.array([field_code(status) for status in log.columns["statuses"]],dtype=np.int64),
+        np.array([field_code(action) for action in log.columns["actions"]],dtype=np.int64),
+    ]
+    columns = [log.update_node,log.update_status,log.update_action]
+
+    codes = np.full((len(rows),len(FIELDS)),MISSING,dtype=np.int64)
+    for j,(table,column) in enumerate(zip(tables,columns)):
+        # Columns hold -1 where the field is missing
+        column = np.asarray(column)[rows]
+        present = column >= 0
+        codes[present,j] = table[column[present]]
+    return StepSignature(np.asarray(log.steps)[rows].astype(np.int64),codes)
+
+'''
+COMPARISON
+'''
+def aligned_length(signature1:StepSignature,signature2:StepSignature) -> int:
+    '''
+    Number of leading steps logged at the same (tick, time) in both logs, which are the steps that can be compared
+    '''
+    n = min(len(signature1),len(signature2))
+    misaligned = np.flatnonzero(np.any(signature1.steps[:n] != signature2.steps[:n],axis=1))
+    return int(misaligned[0]) if len(misaligned) > 0 else n
+
+def difference_fields(signature1:StepSignature,signature2:StepSignature) -> np.ndarray:
+    '''
+    Index in FIELDS of the first field that differs at every aligned step, or -1 where the updates are the same.
+    Fields missing from either update are not compared
+    '''
+    n = aligned_length(signature1,signature2)
+    codes1 = signature1.codes[:n]
+    codes2 = signature2.codes[:n]
+    differs = (codes1 != codes2) & (codes1 != MISSING) & (codes2 != MISSING)
+    return np.where(differs.any(axis=1),differs.argmax(axis=1),-1)
+
+def find_differences(signature1:StepSignature,signature2:StepSignature,difference_type:str=None,first:bool=False) -> list[tuple[int,int,str]]:
+    '''
+    (tick, time, differing field) of every aligned step where the updates differ, optionally only where the first
+    differing field is difference_type, or only the first such step
+    '''
+    fields = difference_fields(signature1,signature2)
+    if difference_type is None:
+        indices = np.flatnonzero(fields >= 0)
+    else:
+        indices = np.flatnonzero(fields == FIELDS.index(difference_type))
+    if first:
+        indices = indices[:1]
+    return [(int(signature1.steps[i][0]),int(signature1.steps[i][1]),FIELDS[fields[i]]) for i in indices]
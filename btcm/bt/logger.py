@@ -1,7 +1,10 @@
 import py_trees
 import networkx as nx
 import json
+import atexit
 import copy
+import queue
+import threading
 from pathlib import Path
 
 from typing import Dict
@@ -10,8 +13,132 @@ from btcm.bt.nodes import ActionNode,ConditionNode
 from btcm.bt.lognode import LogNode
 
 
+def read_log_stream(filepath:str) -> dict:
+    '''
+    Read an append-only (JSON Lines) log written by a streaming Logger and rebuild the nested log dictionary
+
+    The first line holds the tree, state and environment header, and every following line holds a single (tick, time) step.
+    Replaying a log needs every step, so a log missing steps (dropped by a background writer) raises a ValueError
+    '''
+    data = {}
+    next_time = 0 # Times are numbered consecutively across ticks
+    with open(filepath, 'r') as file:
+        header = json.loads(file.readline())
+        data.update(header)
+        for line in file:
+            if line.strip() == "":
+                continue
+            record = json.loads(line)
+            if "dropped" in record:
+                raise ValueError(f"{filepath} is missing {record['dropped']} steps dropped by its background writer, the first at (tick, time) {tuple(record['gaps'][0])}")
+            tick = str(record.pop("tick"))
+            time = str(record.pop("time"))
+            if int(time) != next_time:
+                raise ValueError(f"{filepath} is missing {int(time)-next_time} steps before (tick, time) ({tick}, {time})")
+            next_time = int(time) + 1
+            if tick not in data:
+                data[tick] = {}
+            data[tick][time] = record
+    return data
+
+class BackgroundWriter:
+    '''
+    Writes streamed log records to file on a background thread, so that file I/O does not happen on the tick thread
+
+    Records are handed over through a bounded queue. When the queue is full, the backpressure policy either blocks the
+    tick thread until there is space ("block") or discards the record ("drop"). Dropped records are counted in self.dropped
+    and their (tick, time) kept in self.gaps, which the Logger writes at the end of the log so that it is not replayed
+    '''
+    FLUSH = object()
+    STOP = object()
+
+    def __init__(self,file,queue_size:int=1024,backpressure:str="block"):
+        if backpressure not in ["block","drop"]:
+            raise ValueError(f"Unknown backpressure policy {backpressure}")
+
+        self.file = file
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.backpressure = backpressure
+        self.dropped = 0 # Number of records discarded under the drop policy
+        self.gaps = [] # (tick, time) of every discarded record
+        self.error = None # Exception raised on the writer thread, re-raised on flush/close
+
+        self.thread = threading.Thread(target=self.run,name="LoggerWriter",daemon=True)
+        self.thread.start()
+
+    def put(self,record:dict):
+        if self.backpressure == "block":
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                self.gaps.append([record.get("tick"),record.get("time")])
+
+    def request_flush(self):
+        # Ask the writer thread to flush once it reaches this point, without waiting for it
+        try:
+            self.queue.put_nowait(self.FLUSH)
+        except queue.Full:
+            # The writer is already behind, it will flush on close
+            pass
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is self.STOP:
+                    break
+                if self.error is not None:
+                    # Keep draining so that producers never deadlock
+                    continue
+                if item is self.FLUSH:
+                    self.file.flush()
+                else:
+                    self.file.write(json.dumps(item))
+                    self.file.write("\n")
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check_error(self):
+        if self.error is not None:
+            raise RuntimeError("Background log writer failed") from self.error
+
+    def flush(self):
+        # Block until every queued record has been written
+        self.queue.join()
+        self.check_error()
+        self.file.flush()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join()
+        self.check_error()
+        self.file.flush()
+
 class Logger(py_trees.visitors.VisitorBase):
-    def __init__(self, full:bool = False, tree: py_trees.trees.BehaviourTree = None, filename="log", log_env:bool = True) -> None:
+    '''
+    Visitor that records the BT structure, and the state and updated node of every timestep, in a log file
+
+    Streaming loggers keep their file open and are closed when close() is called or, failing that, when the interpreter
+    exits, so that records still queued for a background writer are written rather than lost with its daemon thread.
+    '''
+    def __init__(
+            self,
+            full:bool = False,
+            tree: py_trees.trees.BehaviourTree = None,
+            filename="log",
+            log_env:bool = True,
+            stream:bool = False,
+            keyframe_interval:int = None,
+            background:bool = False,
+            queue_size:int = 1024,
+            backpressure:str = "block",
+        ) -> None:
         super().__init__(full)
 
         self.tick = 0 # The current tick iteration
@@ -22,6 +149,16 @@ class Logger(py_trees.visitors.VisitorBase):
         self.node_name_counts = {} # Counts the number of nodes with the same name
 
         self.log_env = log_env # Whether to register the environment in the log
+        self.stream = stream # Whether to append each step to a JSON Lines file instead of rewriting the whole log
+        self.keyframe_interval = keyframe_interval # If set, only log changed state variables, with a full state every keyframe_interval steps
+        self.num_steps = 0 # The number of steps logged so far
+        self.last_state = None # The last logged state, used to compute deltas
+        self.background = background # Whether streamed records are written by a background thread
+
+        if self.background and not self.stream:
+            raise ValueError("Background writing is only supported for streaming logs")
+        if self.background and backpressure == "drop" and self.keyframe_interval is not None:
+            raise ValueError("Cannot drop records from a delta-encoded log")
 
         # Create dict of tree nodes and types
         self.make_tree(tree)
@@ -36,7 +173,18 @@ class Logger(py_trees.visitors.VisitorBase):
         self.log_dict = {}
 
         # Log file
-        self.logfile = f"{filename}.json"
+        if self.stream:
+            self.logfile = f"{filename}.jsonl"
+            Path(self.logfile).parent.mkdir(exist_ok=True, parents=True)
+            self.stream_file = open(self.logfile, 'w')
+            atexit.register(self.close)
+        else:
+            self.logfile = f"{filename}.json"
+
+        # Background writer
+        self.writer = None
+        if self.background:
+            self.writer = BackgroundWriter(self.stream_file,queue_size=queue_size,backpressure=backpressure)
 
         # Initialise log
         self.log_structure()
@@ -136,7 +284,15 @@ class Logger(py_trees.visitors.VisitorBase):
                 "module":self.board.environment.__class__.__module__,
             }
 
+        # Write the header once when streaming
+        if self.stream:
+            self.write_record(self.log_dict)
+
     def log(self,behaviour:py_trees.behaviour.Behaviour):
+        if self.stream:
+            self.log_step(behaviour)
+            return
+
         if str(self.tick) in self.log_dict:
             self.log_dict[str(self.tick)][str(self.time)] = {}
         else:
@@ -149,11 +305,32 @@ class Logger(py_trees.visitors.VisitorBase):
             self.log_behaviour(behaviour=behaviour)
 
         # Log new state
-        self.log_dict[str(self.tick)][str(self.time)]["state"] = copy.deepcopy(self.board.state.vals)
+        state_key,state_vals = self.log_state()
+        self.log_dict[str(self.tick)][str(self.time)][state_key] = state_vals
 
         # Save log to file
         self.save_log()
 
+    def log_state(self) -> tuple[str,dict]:
+        '''
+        Returns ("state", full state) for keyframes, or ("delta", changed variables) otherwise
+        '''
+        vals = self.board.state.vals
+        keyframe = self.keyframe_interval is None or self.last_state is None or self.num_steps % self.keyframe_interval == 0
+        self.num_steps += 1
+
+        if keyframe:
+            if self.keyframe_interval is not None:
+                self.last_state = copy.deepcopy(vals)
+            return "state",copy.deepcopy(vals)
+
+        delta = {}
+        for var in vals:
+            if type(vals[var]) is not type(self.last_state[var]) or vals[var] != self.last_state[var]:
+                delta[var] = copy.deepcopy(vals[var])
+                self.last_state[var] = copy.deepcopy(vals[var])
+        return "delta",delta
+
     def log_behaviour(self,behaviour: py_trees.behaviour.Behaviour):
         self.log_dict[str(self.tick)][str(self.time)]["update"] = {
             str(behaviour.id):copy.deepcopy(self.nodes[behaviour.id].status_dict())
@@ -164,6 +341,46 @@ class Logger(py_trees.visitors.VisitorBase):
         with open(self.logfile, 'w') as f:
             json.dump(self.log_dict, f, indent=4)
 
+    '''
+    STREAMING
+    '''
+    def log_step(self,behaviour:py_trees.behaviour.Behaviour):
+        # Append a single (tick, time) record without keeping the log in memory
+        record = {"tick":self.tick,"time":self.time}
+        if behaviour is not None:
+            record["update"] = {
+                str(behaviour.id):self.nodes[behaviour.id].status_dict()
+            }
+        state_key,state_vals = self.log_state()
+        record[state_key] = state_vals
+        self.write_record(record)
+
+    def write_record(self,record:dict):
+        if self.writer is not None:
+            self.writer.put(record)
+            return
+        self.stream_file.write(json.dumps(record))
+        self.stream_file.write("\n")
+
+    def flush(self):
+        if self.stream and not self.stream_file.closed:
+            if self.writer is not None:
+                self.writer.flush()
+            else:
+                self.stream_file.flush()
+
+    def close(self):
+        if self.stream:
+            atexit.unregister(self.close)
+        if self.stream and not self.stream_file.closed:
+            if self.writer is not None:
+                self.writer.close()
+                if self.writer.dropped > 0:
+                    # Mark the log as incomplete so that it is not replayed
+                    self.stream_file.write(json.dumps({"dropped":self.writer.dropped,"gaps":self.writer.gaps}))
+                    self.stream_file.write("\n")
+            self.stream_file.close()
+
     def reconstruct_tree_state(self):
         # Given the known states of all terminated nodes, reconstruct the full state of the tree
         self.print_behaviour_status(self.tree.root)
@@ -175,4 +392,9 @@ class Logger(py_trees.visitors.VisitorBase):
 
     def finalise(self) -> None:
         # Runs after each tick of the tree
-        self.tick += 1
\ No newline at end of file
+        if self.writer is not None:
+            # Don't wait for the disk on the tick thread
+            self.writer.request_flush()
+        else:
+            self.flush()
+        self.tick += 1
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import py_trees
+import networkx as nx
+
+from btcm.dm.state import State
+
+'''
+Persistent cache of compiled causal models
+
+The causal model built by a BTStateManager depends only on the tree structure, the inputs and outputs
+of its leaves, the state variables and the causal edges between them, so it is shared by every log
+produced by the same tree. Entries are stored as pickles named by a hash of those inputs. Node ids
+differ between executions of the same tree, so entries refer to nodes by their position in the tree
+instead. Variable functions are not stored, as they are rebound from the state of the manager loading
+the entry.
+
+Entries are written to a temporary file and atomically renamed, so processes sharing a cache directory
+only ever see complete entries. Unreadable entries are treated as missing.
+'''
+
+CACHE_VERSION = 1
+
+def range_info(var_range) -> dict:
+    return {
+        "range_type":var_range.range_type,
+        "values":None if var_range.values is None else [str(val) for val in var_range.values],
+        "min":var_range.min,
+        "max":var_range.max,
+    }
+
+def canonical_node_ids(tree:dict) -> dict[str,str]:
+    '''
+    Map every node id in a logged tree to an id based on its pre-order position in the tree
+    '''
+    children = {child for node in tree for child in tree[node].get("children",[])}
+    roots = [node for node in tree if node not in children]
+    node_ids = {}
+    def traverse(node):
+        node_ids[node] = f"#{len(node_ids)}"
+        for child in tree[node].get("children",[]):
+            traverse(child)
+    for root in roots:
+        traverse(root)
+    return node_ids
+
+def canonical_tree(tree:dict,node_ids:dict[str,str]) -> dict:
+    '''
+    Logged tree with node ids replaced by their canonical ids, equal for every execution of the same tree
+    '''
+    canonical = {}
+    for node,info in tree.items():
+        info = dict(info)
+        if "children" in info:
+            info["children"] = [node_ids[child] for child in info["children"]]
+        canonical[node_ids[node]] = info
+    return canonical
+
+def renaming(node_ids:dict[str,str]) -> dict[str,str]:
+    '''
+    Extend a mapping between node ids to the causal model variables of those nodes
+    '''
+    rename = dict(node_ids)
+    for node,new_node in node_ids.items():
+        for prefix in ["return_","executed_","decision_"]:
+            rename[f"{prefix}{node}"] = f"{prefix}{new_node}"
+    return rename
+
+def rename_entry(entry:dict,rename:dict[str,str]) -> dict:
+    '''
+    Apply a renaming to every node id and variable name in a compiled model entry
+    '''
+    r = lambda name: rename.get(name,name)
+    return {
+        "state_vars":entry["state_vars"],
+        "node_order":[r(var) for var in entry["node_order"]],
+        "edges":[(r(edge[0]),r(edge[1])) for edge in entry["edges"]],
+        "state_batches":{r(var):batch for var,batch in entry["state_batches"].items()},
+        "node_to_inputs":{r(node):[r(var) for var in inputs] for node,inputs in entry["node_to_inputs"].items()},
+        "update_plans":{r(node):{key:[r(var) for var in plan[key]] for key in plan} for node,plan in entry["update_plans"].items()},
+        "var_chains":entry["var_chains"],
+    }
+
+def entry_graph(entry:dict) -> nx.DiGraph:
+    graph = nx.DiGraph()
+    graph.add_nodes_from(entry["node_order"])
+    graph.add_edges_from(entry["edges"])
+    return graph
+
+def cache_key(
+        data:dict,
+        node_ids:dict[str,str],
+        leaves:dict[str,py_trees.behaviour.Behaviour],
+        dummy_state:State,
+        causal_edges:list[tuple[str,str]],
+) -> str:
+    '''
+    Content hash of everything the compiled causal model depends on, using canonical node ids
+    '''
+    content = {
+        "version":CACHE_VERSION,
+        "tree":canonical_tree(data["tree"],node_ids),
+        "state_class":[data["state"]["class"],data["state"]["module"]],
+        "state_vars":[[var,range_info(var_range)] for var,var_range in dummy_state.ranges().items()],
+        "causal_edges":sorted([list(edge) for edge in causal_edges]),
+        "leaves":{node_ids[node]:[list(leaf.input_variables()),list(leaf.output_variables())] for node,leaf in leaves.items()},
+    }
+    encoded = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+def load_compiled_model(cache_dir:str,key:str) -> dict:
+    path = Path(cache_dir) / f"{key}.pkl"
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+    except Exception:
+        # Treat unreadable entries as a cache miss
+        return None
+    if entry.get("version") != CACHE_VERSION:
+        return None
+    return entry
+
+def save_compiled_model(cache_dir:str,key:str,entry:dict):
+    path = Path(cache_dir)
+    path.mkdir(exist_ok=True, parents=True)
+    entry = dict(entry,version=CACHE_VERSION)
+
+    # Write to a temporary file then atomically replace, so concurrent readers never see a partial entry
+    fd,tmp_path = tempfile.mkstemp(dir=path, prefix=f".{key}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f)
+        os.replace(tmp_path, path / f"{key}.pkl")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
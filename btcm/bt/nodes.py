@@ -1,4 +1,6 @@
 import py_trees
+import threading
+from collections import OrderedDict
 
 from typing import List # For type hints
 
@@ -6,11 +8,33 @@ from btcm.dm.state import State
 from btcm.dm.action import Action,NullAction
 from btcm.bt.lognode import LogNode
 
+class RecordingState:
+    '''
+    Forwards everything to a state, recording the values set through set_value
+    '''
+    def __init__(self,state:State):
+        self.state = state
+        self.writes = {}
+
+    def set_value(self,var:str,value):
+        self.state.set_value(var,value)
+        self.writes[var] = value
+
+    def __getattr__(self,name):
+        return getattr(self.state,name)
+
 class Leaf(py_trees.behaviour.Behaviour):
     '''
     Class for leaf nodes in a PyTrees BT
 
     '''
+    # Nodes whose decide and execute only depend on the values of their input variables and the action (and only
+    # change the state through set_value) can set this so that their results are memoised. The cache is used both
+    # when the node is ticked during a live run (update) and when the state is replayed or intervened on, keeping the
+    # outcome_cache_size most recently used results
+    deterministic = False
+    outcome_cache_size = 1024
+
     def __init__(self, name: str):
         super().__init__(name)
 
@@ -21,6 +45,12 @@ class Leaf(py_trees.behaviour.Behaviour):
         # Logging
         self.lognode:LogNode = None
 
+        # Memoised decide and execute results, if the node is deterministic
+        self.outcome_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_lock = threading.Lock() # Shared by thread pool workers
+
     '''
     EMPTY BOILERPLATE FUNCTIONS
     '''
@@ -76,13 +106,91 @@ class Leaf(py_trees.behaviour.Behaviour):
         It calls the decide() and execute() functions in order. 
         '''
         state = self.board.state
-        action = self.decide(state)
+        action = self.cached_decide(state)
 
         # Logging
         if self.lognode is not None:
             self.lognode.log_action(action)
         
-        return self.execute(state,action)
+        return self.cached_execute(state,action)
+
+    '''
+    MEMOISATION
+    '''
+    def outcome_key(self,kind:str,state:State,action:Action=None) -> tuple:
+        '''
+        Key of a decide or execute call, or None if it cannot be memoised
+        '''
+        if not self.deterministic:
+            return None
+        try:
+            key = (kind,action,tuple(state.get_value(var) for var in self.input_variables()))
+            hash(key)
+        except (KeyError,TypeError):
+            # Inputs missing from the state or unhashable values
+            return None
+        return key
+
+    def cache_get(self,key):
+        # Memoised result of a key, or None if it isn't cached
+        with self.cache_lock:
+            if key in self.outcome_cache:
+                self.cache_hits += 1
+                self.outcome_cache.move_to_end(key)
+                return self.outcome_cache[key]
+            self.cache_misses += 1
+            return None
+
+    def cache_put(self,key,outcome):
+        with self.cache_lock:
+            self.outcome_cache[key] = outcome
+            self.outcome_cache.move_to_end(key)
+            while len(self.outcome_cache) > self.outcome_cache_size:
+                self.outcome_cache.popitem(last=False)
+
+    def cached_decide(self,state:State) -> Action:
+        key = self.outcome_key("decide",state)
+        if key is None:
+            return self.decide(state)
+        action = self.cache_get(key)
+        if action is None:
+            action = self.decide(state)
+            self.cache_put(key,action)
+        return action
+
+    def cached_execute(self,state:State,action:Action) -> py_trees.common.Status:
+        '''
+        Execute, replaying the values set by an earlier execution with the same inputs and action
+        '''
+        key = self.outcome_key("execute",state,action)
+        if key is None:
+            return self.execute(state,action)
+        outcome = self.cache_get(key)
+        if outcome is not None:
+            status,writes = outcome
+            for var,value in writes.items():
+                state.set_value(var,value)
+            return status
+        recorder = RecordingState(state)
+        status = self.execute(recorder,action)
+        self.cache_put(key,(status,recorder.writes))
+        return status
+
+    @property
+    def cache_hit_rate(self) -> float:
+        total = self.cache_hits + self.cache_misses
+        return self.cache_hits / total if total > 0 else 0
+
+    def clear_cache(self):
+        with self.cache_lock:
+            self.outcome_cache.clear()
+        self.reset_cache_counts()
+
+    def reset_cache_counts(self):
+        # Start counting hits again, keeping the memoised results
+        with self.cache_lock:
+            self.cache_hits = 0
+            self.cache_misses = 0
     
     '''
     LOGGING
@@ -124,3 +232,10 @@ class ConditionNode(Leaf):
         '''
         return NullAction()
 
+def cache_hit_rate(leaves:List[Leaf]) -> float:
+    '''
+    Hit rate of the memoised decide and execute results over several leaves
+    '''
+    hits = sum(leaf.cache_hits for leaf in leaves)
+    total = hits + sum(leaf.cache_misses for leaf in leaves)
+    return hits / total if total > 0 else 0
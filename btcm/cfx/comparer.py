@@ -1,10 +1,17 @@
 import py_trees
 
+import os
 import timeit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import Iterator,AsyncIterator
 
 from btcm.cfx.query_manager import QueryManager
-from btcm.cfx.explainer import Explainer,AggregatedCounterfactualExplanation
+from btcm.cfx.explainer import Explainer,AggregatedCounterfactualExplanation,ExplanationAggregator,iterate_in_thread
+from btcm.cfx import parallel
 from btcm.bt.btstate import BTStateManager
+from btcm.bt import log_signature
+from btcm.cm.causalmodel import value_key
 
 def display(text,hide_display:bool=False):
     # TODO: Maybe put this in a utility file
@@ -13,6 +20,16 @@ def display(text,hide_display:bool=False):
     else:
         pass
 
+def exhaust(stream:Iterator):
+    # Run a stream to the end, returning its return value
+    while True:
+        try:
+            next(stream)
+        except StopIteration as stop:
+            return stop.value
+
+FOLLOW_UP_BACKENDS = ["serial","process"]
+
 class Update:
     def __init__(self, name:str, status:str, action:str, tick:int, time:int):
         self.name = name
@@ -31,9 +48,47 @@ class Update:
         }
 
 class Comparer:
-    def __init__(self, manager1:BTStateManager, manager2:BTStateManager):
+    def __init__(self, manager1:BTStateManager, manager2:BTStateManager, explainer_args:dict=None, backend:str="serial", num_workers:int=None):
         self.manager1 = manager1
         self.manager2 = manager2
+        self.explainer_args = explainer_args if explainer_args is not None else {} # Extra arguments for every Explainer
+        self.explainers = [] # Explainers used for the current comparison
+        self.pool = None # Candidate evaluation pool shared by the explainers if they use a parallel backend, see close
+
+        # How the follow-up queries of a round are searched: "serial", or "process" to search the distinct queries on a
+        # forked process pool. Threads would share the replayed state of the second log, so they are not supported
+        if backend not in FOLLOW_UP_BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, must be one of {FOLLOW_UP_BACKENDS}")
+        self.backend = backend
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+        self.worker_num_pruned = 0 # Counts of the explainers used in worker processes for the current comparison
+        self.worker_num_truncated = 0
+        self.loaded = None # (tick, time) of the state loaded in the second manager by the comparer
+
+    @property
+    def num_pruned(self) -> int:
+        # Number of candidates skipped by minimality pruning in the current comparison
+        return sum(explainer.num_pruned for explainer in self.explainers) + self.worker_num_pruned
+
+    @property
+    def num_truncated(self) -> int:
+        # Number of queries in the current comparison whose search ran out of budget
+        return sum(explainer.num_truncated for explainer in self.explainers) + self.worker_num_truncated
+
+    def make_explainer(self) -> Explainer:
+        explainer_backend = self.explainer_args.get("backend","serial")
+        if explainer_backend != "serial" and self.pool is None:
+            num_workers = self.explainer_args.get("num_workers")
+            self.pool = parallel.WorkerPool(self.manager2.model,explainer_backend,num_workers if num_workers is not None else os.cpu_count())
+        explainer = Explainer(self.manager2.model, node_names=self.node_names, history=self.manager2.value_history, pool=self.pool, **self.explainer_args)
+        self.explainers.append(explainer)
+        return explainer
+
+    def close(self):
+        # Shut down the workers of the shared explainer pool, which explain_follow_ups and explain_first_difference do
+        # when they finish. Streams should be followed by close
+        if self.pool is not None:
+            self.pool.close()
 
     '''
     FOLLOW-UP
@@ -57,11 +112,39 @@ class Comparer:
             num_cfx
             msg
         '''
+        try:
+            return exhaust(self.iter_follow_ups(
+                target_var=target_var,
+                max_follow_ups=max_follow_ups,
+                max_depth=max_depth,
+                visualise=visualise,
+                visualise_only_valid=visualise_only_valid,
+                hide_display=hide_display,
+            ))
+        finally:
+            self.close()
+
+    def iter_follow_ups(
+            self,
+            target_var:str,
+            max_follow_ups:int=2,
+            max_depth:int=1,
+            visualise:bool=False,
+            visualise_only_valid:bool=False,
+            hide_display:bool=False,
+    ) -> Iterator[tuple[int,AggregatedCounterfactualExplanation]]:
+        '''
+        Yield (round, explanation) as soon as each aggregated explanation is found, returning the results of
+        explain_follow_ups once the stream ends. Explanations gain values in place until their query finishes
+        '''
         # Start timer
         start_timer = timeit.default_timer()
+        self.explainers = []
+        self.worker_num_pruned = 0
+        self.worker_num_truncated = 0
 
         # First round of explanations
-        explanations,tick,time,num_nodes,num_cfx = self.explain_first_difference(
+        explanations,tick,time,num_nodes,num_cfx = yield from self.iter_first_difference(
             max_depth=max_depth,
             visualise=visualise,
             visualise_only_valid=visualise_only_valid,
@@ -88,81 +171,36 @@ class Comparer:
             step = 2
 
             # Reinitialise
-            
-            explainer = Explainer(self.manager2.model, node_names=self.node_names, history=self.manager2.value_history)
-            query_manager = QueryManager(explainer, self.manager2, visualise=visualise, visualise_only_valid=visualise_only_valid)
-           
+            explainer = self.make_explainer()
 
             while step <= max_follow_ups:
                 display(f"\n==========\n==========\nROUND {step}\n==========\n==========",hide_display=hide_display)
-                next_exps = []
-                for explanation in explanations:
-                    # Reinitialise
-                    self.manager2.load_state(tick=explanation.tick,time=explanation.time)
-                    explainer = Explainer(self.manager2.model, node_names=self.node_names, history=self.manager2.value_history)
-                    query_manager = QueryManager(explainer, self.manager2, visualise=visualise, visualise_only_valid=visualise_only_valid)
-
-                    # Create query
-                    foil = self.foil_from_explanation(explanation)
-                    curr_tick = explanation.tick
-                    vars = list(foil.keys())
-                    if len(list(foil.keys())) == 1:
-                        # TODO: Fix to handle multiple 
-                        var = vars[0]                    
-                        update_history = self.manager2.update_history[var]
-                        curr_tick,curr_time = self.get_curr_time([var],{var:update_history},curr_tick)
-                        num_parents = sum(1 for _ in self.manager2.model.graph.predecessors(var))
-                    else:
-                        update_history = {var:self.manager2.update_history[var] for var in vars}
-                        curr_tick,curr_time = self.get_curr_time(vars,update_history,curr_tick)
-                        num_parents_list = [sum(1 for _ in self.manager2.model.graph.predecessors(var)) for var in vars]
-                        num_parents = max(num_parents_list)
-
-                    # Check if the variable has any parents
-                    attempt_explanation = True
-                    if num_parents == 0:
-                        if curr_tick == 0:
-                            #Impossible to go back further
-                            display("Cannot attempt explanation")
-                            attempt_explanation = False
-                        else:
-                            # TODO: keep going back until a the chosen variable has parents
-                            # Reinitialise to a new tick
-                            curr_tick = curr_tick - 1
-                            curr_times = []
-                            new_foil = {}
-                            for var in vars:
-                                same_nodes = sorted([node for node in self.manager2.update_history if str(curr_tick) in self.manager2.update_history[node] and self.node_names[node] == self.node_names[var]])
-                                last_node = same_nodes[-1]
-                                new_foil[last_node] = foil[var]
-                                curr_times.append(int(list(self.manager2.update_history[last_node][str(curr_tick)].keys())[-1]))
-                            curr_time = max(curr_times)
-                            self.manager2.load_state(tick=curr_tick,time=curr_time)
-                            explainer = Explainer(self.manager2.model, node_names=self.node_names, history=self.manager2.value_history)
-                            query_manager = QueryManager(explainer, self.manager2, visualise=visualise, visualise_only_valid=visualise_only_valid)
-
-                            # Update foil value
-                            foil = new_foil
-                            
-
-                        
-                    if attempt_explanation:
-                        # Reinitialise
-                        self.manager2.load_state(tick=explanation.tick,time=explanation.time)
-                        explainer = Explainer(self.manager2.model, node_names=self.node_names, history=self.manager2.value_history)
-                        query_manager = QueryManager(explainer, self.manager2, visualise=visualise, visualise_only_valid=visualise_only_valid)
-
-                        query = query_manager.make_follow_up_query(foil,curr_tick,curr_time)
-                        new_explanations,new_num_cfx = explainer.explain(query, max_depth=max_depth, visualise=visualise, visualise_only_valid=visualise_only_valid,return_cfx_candidates_nums=True)
-                        num_cfx += new_num_cfx
-
-                        display(f"\n=====QUERY=====\n{query_manager.query_text(query)}", hide_display=hide_display)
-                        display("\n=====EXPLANATION=====",hide_display=hide_display)
-                        for exp in new_explanations:
-                            display(f"-----{exp.text()}",hide_display=hide_display)
-
-                        # Add new explanations to a list of all explanations for this round
-                        next_exps += new_explanations
+
+                # Group the explanations by the state their follow-up queries are asked in, so that each state is loaded once
+                groups = {}
+                for i,explanation in enumerate(explanations):
+                    groups.setdefault((explanation.tick,explanation.time),[]).append(i)
+
+                round_results = []
+                if self.backend == "serial" or visualise:
+                    for (tick,time),indices in groups.items():
+                        round_results += yield from self.iter_follow_up_group(explanations,indices,tick,time,step,max_depth,visualise,visualise_only_valid)
+                else:
+                    round_results = yield from self.iter_follow_ups_in_pool(explanations,groups,step,max_depth)
+
+                round_exps = {}
+                for i,query_text,new_explanations,new_num_cfx in round_results:
+                    num_cfx += new_num_cfx
+
+                    display(f"\n=====QUERY=====\n{query_text}", hide_display=hide_display)
+                    display("\n=====EXPLANATION=====",hide_display=hide_display)
+                    for exp in new_explanations:
+                        display(f"-----{exp.text()}",hide_display=hide_display)
+
+                    round_exps[i] = new_explanations
+
+                # Add new explanations to a list of all explanations for this round, in the order of the explanations they follow up
+                next_exps = [exp for i in sorted(round_exps) for exp in round_exps[i]]
 
                 curr_diff_timer = timeit.default_timer()
                 curr_diff = curr_diff_timer - start_timer 
@@ -180,6 +218,121 @@ class Comparer:
 
         return False,0,0,len(explainer.model.nodes),curr_diff,num_cfx,"Unknown"
 
+    def follow_up_queries(self,explanations:list[AggregatedCounterfactualExplanation],indices:list[int],query_manager:QueryManager) -> list[tuple]:
+        '''
+        (index, key, query, query text) of the follow-up query of every explanation at the given indices that has one.
+        The state of the explanations must be loaded, and identical queries have the same key
+        '''
+        queries = []
+        for i in indices:
+            # The update history depends on the loaded state
+            follow_up = self.follow_up_foil(explanations[i])
+            if follow_up is None:
+                continue
+            foil,curr_tick,curr_time = follow_up
+            query = query_manager.make_follow_up_query(foil,curr_tick,curr_time)
+            key = (tuple((var,value_key(vals)) for var,vals in foil.items()),curr_tick,curr_time)
+            queries.append((i,key,query,query_manager.query_text(query)))
+        return queries
+
+    def iter_follow_up_group(
+            self,
+            explanations:list[AggregatedCounterfactualExplanation],
+            indices:list[int],
+            tick:int,
+            time:int,
+            step:int,
+            max_depth:int=1,
+            visualise:bool=False,
+            visualise_only_valid:bool=False,
+    ) -> Iterator[tuple[int,AggregatedCounterfactualExplanation]]:
+        '''
+        Ask the follow-up queries of the explanations at the given indices, which share the state at (tick, time),
+        yielding (step, explanation) as they are found. Returns (index, query text, explanations, num_cfx) for every
+        explanation that has a follow-up query
+        '''
+        # Reinitialise
+        self.load_state(tick,time)
+        explainer = self.make_explainer()
+        query_manager = QueryManager(explainer, self.manager2, visualise=visualise, visualise_only_valid=visualise_only_valid)
+
+        # Identical queries are only searched once
+        searched = {}
+        results = []
+        for i,key,query,query_text in self.follow_up_queries(explanations,indices,query_manager):
+            if key not in searched:
+                searched[key] = yield from self.stream_explain(explainer, query, step, max_depth=max_depth, visualise=visualise, visualise_only_valid=visualise_only_valid)
+            else:
+                for exp in searched[key][0]:
+                    yield step,exp
+            new_explanations,new_num_cfx = searched[key]
+            results.append((i,query_text,new_explanations,new_num_cfx))
+        return results
+
+    def iter_follow_ups_in_pool(
+            self,
+            explanations:list[AggregatedCounterfactualExplanation],
+            groups:dict[tuple,list[int]],
+            step:int,
+            max_depth:int,
+    ) -> Iterator[tuple[int,AggregatedCounterfactualExplanation]]:
+        '''
+        Same as asking the follow-up queries of every group with iter_follow_up_group, but searching the distinct
+        queries on a forked process pool, where each worker replays states in its own copy of the second log.
+        Explanations are yielded once each query finishes, in the order of the serial search
+        '''
+        # The queries are made in this process, loading each state once
+        group_queries = []
+        searches = {} # Distinct searches, with the state they are asked in
+        for (tick,time),indices in groups.items():
+            self.load_state(tick,time)
+            query_manager = QueryManager(self.make_explainer(), self.manager2)
+            queries = self.follow_up_queries(explanations,indices,query_manager)
+            for _,key,query,_ in queries:
+                if (tick,time,key) not in searches:
+                    searches[(tick,time,key)] = (tick,time,query)
+            group_queries.append(((tick,time),queries))
+
+        searched = {}
+        if len(searches) == 1:
+            # Not worth starting a pool
+            search,(tick,time,query) = next(iter(searches.items()))
+            self.load_state(tick,time)
+            searched[search] = exhaust(self.stream_explain(self.make_explainer(),query,step,max_depth=max_depth))
+        elif len(searches) > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=min(self.num_workers,len(searches)),
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=init_follow_up_worker,
+                initargs=(self,step,max_depth),
+            )
+            with executor:
+                futures = {search:executor.submit(follow_up_in_worker,*searches[search]) for search in searches}
+                for search,future in futures.items():
+                    new_explanations,new_num_cfx,num_pruned,num_truncated = future.result()
+                    self.worker_num_pruned += num_pruned
+                    self.worker_num_truncated += num_truncated
+
+                    # Explanations are sent back without their state
+                    for exp in new_explanations:
+                        exp.state = self.manager2.state
+                    searched[search] = (new_explanations,new_num_cfx)
+
+        results = []
+        for (tick,time),queries in group_queries:
+            for i,key,_,query_text in queries:
+                new_explanations,new_num_cfx = searched[(tick,time,key)]
+                for exp in new_explanations:
+                    yield step,exp
+                results.append((i,query_text,new_explanations,new_num_cfx))
+        return results
+
+    def aiter_follow_ups(self,target_var:str,**kwargs) -> AsyncIterator[tuple[int,AggregatedCounterfactualExplanation]]:
+        '''
+        Asynchronous version of iter_follow_ups, searching in a worker thread so the event loop is not blocked
+        '''
+        return iterate_in_thread(self.iter_follow_ups(target_var,**kwargs))
+
         
 
 
@@ -189,6 +342,16 @@ class Comparer:
     EXPLANATION
     '''
     def explain_first_difference(self,max_depth:int=1,visualise:bool=False,visualise_only_valid:bool=False,hide_display:bool=False):
+        try:
+            return exhaust(self.iter_first_difference(max_depth=max_depth,visualise=visualise,visualise_only_valid=visualise_only_valid,hide_display=hide_display))
+        finally:
+            self.close()
+
+    def iter_first_difference(self,max_depth:int=1,visualise:bool=False,visualise_only_valid:bool=False,hide_display:bool=False):
+        '''
+        Yield (1, explanation) for the explanations of the first difference as they are found, returning the results
+        of explain_first_difference once the stream ends
+        '''
         # Get the first difference between the two queries
         same, difference, update1, update2 = self.find_first_difference()
         explanations = []
@@ -201,11 +364,12 @@ class Comparer:
             time = update2.time
         
         # Load the state
-        self.manager2.load_state(tick=tick, time=time)
+        self.loaded = None
+        self.load_state(tick,time)
         self.node_names = self.manager2.pretty_node_names()
 
         # Load the explainer
-        explainer = Explainer(self.manager2.model, node_names=self.node_names, history=self.manager2.value_history)
+        explainer = self.make_explainer()
 
         # Query manager
         query_manager = QueryManager(explainer, self.manager2, visualise=visualise, visualise_only_valid=visualise_only_valid)
@@ -218,7 +382,7 @@ class Comparer:
         query = self.build_difference_query(difference,query_manager,update1,update2)
         
         
-        explanations,num_cfx = explainer.explain(query, max_depth=max_depth, visualise=visualise, visualise_only_valid=visualise_only_valid,return_cfx_candidates_nums=True)
+        explanations,num_cfx = yield from self.stream_explain(explainer, query, 1, max_depth=max_depth, visualise=visualise, visualise_only_valid=visualise_only_valid)
         display(f"\n=====QUERY=====\n{query_manager.query_text(query)}", hide_display=hide_display)
         display("\n=====EXPLANATION=====",hide_display=hide_display)
         for explanation in explanations:
@@ -228,6 +392,18 @@ class Comparer:
         
         return explanations,update2.tick,update2.time,len(explainer.model.nodes),num_cfx
     
+    def stream_explain(self,explainer:Explainer,query,step:int,max_depth:int=1,visualise:bool=False,visualise_only_valid:bool=False):
+        '''
+        Yield (step, explanation) for every new aggregated explanation of a query, returning the same as
+        explainer.explain with return_cfx_candidates_nums once the search finishes
+        '''
+        aggregator = ExplanationAggregator()
+        for exp in explainer.iter_explain(query, max_depth=max_depth, visualise=visualise, visualise_only_valid=visualise_only_valid):
+            aggregated_exp,new = aggregator.add(exp)
+            if new:
+                yield step,aggregated_exp
+        return aggregator.explanations(),explainer.search_info["num_cfx_candidates"]
+
     '''
     QUERY
     '''
@@ -265,6 +441,40 @@ class Comparer:
 
         return target_found
     
+    def follow_up_foil(self,explanation:AggregatedCounterfactualExplanation) -> tuple[dict,int,int]:
+        '''
+        Foil, tick and time of the follow-up query for an explanation, or None if no follow-up can be asked.
+        The state of the explanation must be loaded
+        '''
+        foil = self.foil_from_explanation(explanation)
+        curr_tick = explanation.tick
+        vars = list(foil.keys())
+        update_history = {var:self.manager2.update_history[var] for var in vars}
+        curr_tick,curr_time = self.get_curr_time(vars,update_history,curr_tick)
+        num_parents = max(sum(1 for _ in self.manager2.model.graph.predecessors(var)) for var in vars)
+
+        # Check if the variable has any parents
+        if num_parents == 0:
+            if curr_tick == 0:
+                #Impossible to go back further
+                display("Cannot attempt explanation")
+                return None
+
+            # TODO: keep going back until a the chosen variable has parents
+            # Go back to the previous tick
+            curr_tick = curr_tick - 1
+            curr_times = []
+            new_foil = {}
+            for var in vars:
+                same_nodes = sorted([node for node in self.manager2.update_history if str(curr_tick) in self.manager2.update_history[node] and self.node_names[node] == self.node_names[var]])
+                last_node = same_nodes[-1]
+                new_foil[last_node] = foil[var]
+                curr_times.append(int(list(self.manager2.update_history[last_node][str(curr_tick)].keys())[-1]))
+            curr_time = max(curr_times)
+            foil = new_foil
+
+        return foil,curr_tick,curr_time
+
     def foil_from_explanation(self,explanation:AggregatedCounterfactualExplanation):
         # TODO: Add previous foil???
         # TODO: Handle explanations with multiple intervention variables
@@ -277,71 +487,42 @@ class Comparer:
     COMPARISON
     '''
     def find_first_difference(self,difference_type=None):
-        # TODO: Maybe difference type should be in a different function that looks at updates of a particular type regardless of the tick and time
-        data1 = self.manager1.data
-        data2 = self.manager2.data
-
-        tick = 0
-        time = 1
-        stop = False
-
-        same = True
-        difference = None
-        u1 = None
-        u2 = None
-
-        while not stop:
-            if str(tick) not in data1.keys() or str(tick) not in data2.keys():
-                break
+        differences = self.find_differences(difference_type=difference_type,first=True)
+        if len(differences) == 0:
+            return True,None,None,None
+        difference,u1,u2 = differences[0]
+        return False,difference,u1,u2
 
-            while True:
-                if str(time) not in data1[str(tick)].keys() or str(time) not in data2[str(tick)].keys():
-                    if str(time) in data1[str(tick)].keys():
-                        print(f"Tick {tick} time {time} not in data2")
-                    elif str(time) in data2[str(tick)].keys():
-                        print(f"Tick {tick} time {time} not in data1")
-                    break
-
-                update1 = data1[str(tick)][str(time)]["update"]
-                update2 = data2[str(tick)][str(time)]["update"]
-
-                same,difference,contents1,contents2 = self.compare_updates(update1,update2)
-
-                stop = False
-                if difference_type is not None:
-                    if difference == difference_type:
-                        stop = True
-                else:
-                    if not same:
-                        stop = True
-
-                if stop:
-                    u1 = Update(contents1["name"],contents1["status"],contents1["action"],tick,time)
-                    u2 = Update(contents2["name"],contents2["status"],contents2["action"],tick,time)
-                    break
-
-                # Update
-                time += 1
-            if not stop:
-                tick += 1
+    def find_differences(self,difference_type=None,first:bool=False) -> list[tuple[str,Update,Update]]:
+        '''
+        (difference, update1, update2) at every step, logged at the same tick and time in both logs, where the updates
+        differ. Only the steps where the first differing field is difference_type are returned if it is given
+        '''
+        differences = log_signature.find_differences(
+            self.manager1.step_signature(),
+            self.manager2.step_signature(),
+            difference_type=difference_type,
+            first=first,
+        )
+        return [
+            (difference,self.logged_update(self.manager1,tick,time),self.logged_update(self.manager2,tick,time))
+            for tick,time,difference in differences
+        ]
 
-        return same,difference,u1,u2
+    def logged_update(self,manager:BTStateManager,tick:int,time:int) -> Update:
+        update = manager.data[str(tick)][str(time)]["update"]
+        contents = update[list(update.keys())[0]]
+        return Update(contents["name"],contents["status"],contents.get("action"),tick,time)
 
-    def compare_updates(self,update1,update2):
-        # Compare the updates
-        contents1 = update1[list(update1.keys())[0]]
-        contents2 = update2[list(update2.keys())[0]]
-        
-        for comparison_point in ["name","status","action"]:
-            if comparison_point in contents1.keys() and comparison_point in contents2.keys():
-                if contents1[comparison_point] != contents2[comparison_point]:
-                    return False,comparison_point,contents1,contents2
-                
-        return True,None,None,None
-    
     '''
     UTILITY
     '''
+    def load_state(self,tick:int,time):
+        # Load a state of the second log, unless it is already loaded
+        if self.loaded != (tick,time):
+            self.manager2.load_state(tick=tick,time=time)
+            self.loaded = (tick,time)
+
     def get_curr_time(self,vars,update_history,curr_tick):
         times = []
         for var in vars:
@@ -351,4 +532,22 @@ class Comparer:
             times.append(int(list(update_history[var][str(curr_tick)].keys())[-1]))
             
         curr_time = max(times)
-        return curr_tick,curr_time
\ No newline at end of file
+        return curr_tick,curr_time
+
+'''
+PROCESS WORKERS
+'''
+follow_up_context = None # (comparer, step, max_depth) of the current round in each worker process
+
+def init_follow_up_worker(comparer:Comparer,step:int,max_depth:int):
+    global follow_up_context
+    follow_up_context = (comparer,step,max_depth)
+
+def follow_up_in_worker(tick:int,time:int,query) -> tuple[list[AggregatedCounterfactualExplanation],int,int,int]:
+    comparer,step,max_depth = follow_up_context
+    comparer.load_state(tick,time)
+    # The follow-ups are already spread over processes, so candidates are evaluated serially rather than in nested pools
+    explainer_args = {**comparer.explainer_args,"backend":"serial"}
+    with Explainer(comparer.manager2.model, node_names=comparer.node_names, history=comparer.manager2.value_history, **explainer_args) as explainer:
+        new_explanations,new_num_cfx = exhaust(comparer.stream_explain(explainer,query,step,max_depth=max_depth))
+    return new_explanations,new_num_cfx,explainer.num_pruned,explainer.num_truncated
@@ -1,12 +1,17 @@
 import networkx as nx
 import itertools
+import asyncio
 import copy
+import os
+import time
 
-from btcm.cm.causalmodel import CausalModel
+from btcm.cm.causalmodel import CausalModel,value_key
 from btcm.dm.state import State
 from btcm.util.util import take_closest
+from btcm.cfx import parallel
 
 from typing import Dict,List
+from collections.abc import Iterator,AsyncIterator
 
 class CounterfactualQuery:
     def __init__(self,foils:Dict[str,list],tick:int = 0, time:int = "end"):
@@ -27,11 +32,17 @@ class CounterfactualQuery:
         '''
         Returns True if the state satisfies the conditions outlined by the foils provided to the query
         '''
+        return self.satisfies_values(state.get_values(self.foil_vars()),state.range_dict,rounding=rounding)
+
+    def satisfies_values(self,values:dict,range_dict:dict,rounding:bool=True) -> bool:
+        '''
+        Returns True if the values of the foil variables satisfy the conditions outlined by the foils
+        '''
         for var in self.foils:
-            val = state.get_value(var)
-            if rounding and state.range_dict[var].range_type == "disc_cont":
+            val = values[var]
+            if rounding and range_dict[var].range_type == "disc_cont":
                 # Round the queried value to the nearest discretisation if applicable
-                disc_vals = state.range_dict[var].values
+                disc_vals = range_dict[var].values
                 val = take_closest(disc_vals,val)
 
             if val not in self.foils[var]: 
@@ -48,6 +59,12 @@ class CounterfactualExplanation:
         self.tick = tick
         self.time = time
 
+    def __getstate__(self):
+        # The state is left out when pickling, as it cannot always be pickled, and has to be set again after loading
+        attributes = self.__dict__.copy()
+        attributes["state"] = None
+        return attributes
+
     def assignment_string(self,names:dict,values:dict=None,node_names:dict[str,str]=None):
         if values is None:
             values = names
@@ -169,11 +186,137 @@ class AggregatedCounterfactualExplanation(CounterfactualExplanation):
         
 
 
+class ExplanationAggregator:
+    '''
+    Groups explanations that share the same variables and foil values into aggregated explanations as they are
+    added, so an aggregated explanation gains the values of every later explanation in its group
+    '''
+    def __init__(self):
+        self.groups:Dict[tuple,Dict[tuple,AggregatedCounterfactualExplanation]] = {}
+
+    def add(self,exp:CounterfactualExplanation) -> tuple[AggregatedCounterfactualExplanation,bool]:
+        '''
+        Add an explanation, returning the aggregated explanation of its group and whether the group is new
+        '''
+        var_key = tuple(sorted(exp.reason.keys()))
+        foil_key = tuple([str(exp.counterfactual_foil[var]) for var in sorted(exp.counterfactual_foil)])
+        if var_key not in self.groups:
+            self.groups[var_key] = {}
+
+        if foil_key in self.groups[var_key]:
+            aggregated_exp = self.groups[var_key][foil_key]
+            for var in exp.counterfactual_intervention:
+                aggregated_exp.counterfactual_intervention[var].append(exp.counterfactual_intervention[var])
+            return aggregated_exp,False
+
+        intervention_dict = {var:[val] for var,val in exp.counterfactual_intervention.items()}
+        aggregated_exp = AggregatedCounterfactualExplanation(intervention_dict,exp.counterfactual_foil,exp.state,exp.tick,exp.time)
+        self.groups[var_key][foil_key] = aggregated_exp
+        return aggregated_exp,True
+
+    def explanations(self) -> List[AggregatedCounterfactualExplanation]:
+        return [exp for foils in self.groups.values() for exp in foils.values()]
+
+async def iterate_in_thread(iterator:Iterator) -> AsyncIterator:
+    '''
+    Asynchronously iterate over a blocking iterator, advancing it in a worker thread
+    '''
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next,iterator,done)
+        if item is done:
+            return
+        yield item
+
+
+class SearchBudget:
+    '''
+    Wall clock (seconds) and candidate limits on a search, None for no limit
+    '''
+    def __init__(self,time_limit:float=None,max_candidates:int=None):
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.max_candidates = max_candidates
+        self.num_candidates = 0 # Candidates handed out for evaluation
+        self.truncated = False # Whether candidates were left unevaluated when the budget ran out
+
+    def exhausted(self) -> bool:
+        if self.max_candidates is not None and self.num_candidates >= self.max_candidates:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def take(self,combos):
+        '''
+        Yield candidates until the budget runs out
+        '''
+        for combo in combos:
+            if self.exhausted():
+                self.truncated = True
+                return
+            self.num_candidates += 1
+            yield combo
+
+
 class Explainer:
-    def __init__(self,model:CausalModel,node_names:dict[str,str]=None,history:dict=None):
+    '''
+    Searches for counterfactual explanations of queries on a causal model
+
+    The thread and process backends evaluate candidates in chunks of chunk_size on a pool that is created at the first
+    parallel evaluation and kept until close() or the end of a with block, or shared by the explainers of a Comparer.
+    The state, query and search graph are sent to the pool once per query. These backends give the same explanations
+    as the serial search but have not been shown to be faster: they were only measured on one core, where the process
+    backend took about twice as long as the serial search on the random logs, so serial remains the default.
+    '''
+    def __init__(
+            self,
+            model:CausalModel,
+            node_names:dict[str,str]=None,
+            history:dict=None,
+            overlay:bool=True,
+            backend:str="serial",
+            num_workers:int=None,
+            chunk_size:int=64,
+            pool:parallel.WorkerPool=None,
+            reuse_budget:int=100000,
+            time_budget:float=None,
+            candidate_budget:int=None,
+        ):
         self.model = model
         self.node_names = node_names
         self.history = history
+        self.overlay = overlay # Whether interventions use overlay states rather than full copies of the state
+
+        # How candidate interventions are evaluated: "serial", "thread" (thread pool) or "process" (forked process pool)
+        if backend not in parallel.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, must be one of {parallel.BACKENDS}")
+        self.backend = backend
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+        self.chunk_size = chunk_size # Number of candidates sent to a worker at once
+        self.owns_pool = pool is None and backend != "serial"
+        if self.owns_pool:
+            pool = parallel.WorkerPool(model,backend,self.num_workers)
+        self.pool = pool
+
+        # Maximum number of intervened states kept from one depth to extend at the next, 0 to disable
+        self.reuse_budget = reuse_budget
+
+        # Default limits on the seconds and candidates spent on each query, None for no limit
+        self.time_budget = time_budget
+        self.candidate_budget = candidate_budget
+
+        self.num_pruned = 0 # Number of candidates skipped by minimality pruning, over every query explained
+        self.num_truncated = 0 # Number of queries whose search ran out of budget
+        self.search_info = None # Summary of the last search, see explain
+
+    def close(self):
+        # Shut down the workers of the explainer's own pool, a shared pool is closed by its owner
+        if self.owns_pool:
+            self.pool.close()
+
+    def __enter__(self) -> "Explainer":
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
 
     '''
     QUERY
@@ -209,14 +352,31 @@ class Explainer:
                     proper_foil[var].remove(remove_val)
         return CounterfactualQuery(foils=proper_foil,tick=tick,time=time)
     
+    def validate_query(self,query:CounterfactualQuery):
+        for var in query.foils:
+            if query.foils[var] is None:
+                continue
+            for var_val in query.foils[var]:
+                if var_val == self.model.state.get_value(var):
+                    raise ValueError(f"Cannot construct query with {var} = {var_val} as it is the current value of the variable")
+
     '''
     SEARCH SPACE
     '''
-    def reduce_model(self,query) -> Dict[str,list]:
+    def reduce_model(self,query,ancestor_cache:dict=None,value_cache:dict=None) -> Dict[str,list]:
+        '''
+        Variables that can be intervened on to change the foils, with their possible values other than the current one.
+        ancestor_cache and value_cache can be shared between queries on the same state to avoid recomputation
+        '''
         # First get the list of possible explanation variables
         ancestors = []
         for node in query.foils:
-            ancestors += nx.ancestors(self.model.graph,node)
+            if ancestor_cache is None:
+                ancestors += nx.ancestors(self.model.graph,node)
+                continue
+            if node not in ancestor_cache:
+                ancestor_cache[node] = nx.ancestors(self.model.graph,node)
+            ancestors += ancestor_cache[node]
         ancestors = list(set(ancestors))
 
         # Remove variables that shouldn't be intervened on
@@ -225,17 +385,23 @@ class Explainer:
         # Next, get all possible values for each
         search_space:Dict[str,list] = {}
         for node in potential_variables:
+            if value_cache is not None and node in value_cache:
+                search_space[node] = list(value_cache[node])
+                continue
+
             values = self.model.state.ranges()[node].values
             if values is None:
                 raise TypeError(f"Invalid: var range of type {self.model.state.ranges()[node].range_type} has no values for variable {node}")
             search_space[node] = copy.deepcopy(values)
 
-        # Remove true values from search space
-        for node in potential_variables:
+            # Remove true values from search space
             real_val = self.model.state.get_value(node)
             # Check if real val is in the space (it may not be due to discretisation)
             if real_val in search_space[node]:
-                search_space[node].remove(self.model.state.get_value(node)) 
+                search_space[node].remove(real_val)
+
+            if value_cache is not None:
+                value_cache[node] = list(search_space[node])
         
         return search_space
     
@@ -244,33 +410,135 @@ class Explainer:
 
         return self.model.graph.subgraph(allowed_nodes)
         
-    def generate_combinations(self,search_space, N):
+    def generate_combinations(self,search_space, N, skip=None):
+        '''
+        Lazily yield every intervention that changes N variables of the search space, leaving out any combination of
+        variables for which skip(var_combination) is True
+        '''
         variable_names = list(search_space.keys())
-        combinations = []
 
         # Generate all combinations of N variable names
         for var_combination in itertools.combinations(variable_names, N):
+            if skip is not None and skip(var_combination):
+                continue
+
             # Generate all possible value combinations for the selected variables
             value_combinations = itertools.product(*[search_space[var] for var in var_combination])
 
-            # Create a list of dictionaries representing the changes
+            # Yield dictionaries representing the changes
             for values in value_combinations:
-                change = {var: value for var, value in zip(var_combination, values)}
-                combinations.append(change)
+                yield {var: value for var, value in zip(var_combination, values)}
 
-        return combinations
+    def count_combinations(self,search_space, N) -> int:
+        '''
+        Number of interventions yielded by generate_combinations, without enumerating them
+        '''
+        # counts[k] is the number of interventions changing k of the variables seen so far
+        counts = [1] + [0]*N
+        for var in search_space:
+            num_values = len(search_space[var])
+            for k in range(N,0,-1):
+                counts[k] += counts[k-1]*num_values
+        return counts[N]
+
+    '''
+    PRUNING
+    '''
+    def reaches_foil(self,node:str,blocked:set,query:CounterfactualQuery,search_graph:nx.DiGraph) -> bool:
+        '''
+        True if there is a path from node to a foil variable in the search graph that avoids the blocked variables
+        '''
+        visited = {node}
+        frontier = [node]
+        while frontier:
+            curr = frontier.pop()
+            if curr in query.foils and curr != node:
+                return True
+            for child in search_graph.successors(curr):
+                if child not in visited and child not in blocked:
+                    visited.add(child)
+                    frontier.append(child)
+        return False
+
+    def prunable(self,var_combination:tuple,refuted:set,query:CounterfactualQuery,search_graph:nx.DiGraph) -> bool:
+        '''
+        A combination of variables can be skipped if one of them can only affect the foil through the others,
+        as every intervention on it then has the same outcome as one on the others, which have already been refuted
+        '''
+        for var in var_combination:
+            others = frozenset(v for v in var_combination if v != var)
+            if others in refuted and not self.reaches_foil(var,others,query,search_graph):
+                return True
+        return False
    
     '''
     EXPLAIN
     '''
-    def explain(self,query:CounterfactualQuery,max_depth:int = None, visualise:bool = False, visualise_only_valid:bool =False, visualised_interventions: list = None, return_cfx_candidates_nums: bool = False) -> List[CounterfactualExplanation]:
-        # Validate
-        for var in query.foils:
-            if query.foils[var] is None:
-                continue
-            for var_val in query.foils[var]:
-                if var_val == self.model.state.get_value(var):
-                    raise ValueError(f"Cannot construct query with {var} = {var_val} as it is the current value of the variable")
+    def explain(
+            self,
+            query:CounterfactualQuery,
+            max_depth:int = None,
+            visualise:bool = False,
+            visualise_only_valid:bool =False,
+            visualised_interventions: list = None,
+            return_cfx_candidates_nums: bool = False,
+            time_budget:float = None,
+            candidate_budget:int = None,
+            return_search_info:bool = False,
+    ) -> List[CounterfactualExplanation]:
+        '''
+        Search for the explanations changing the fewest variables. If the time (seconds) or candidate budget runs out,
+        the explanations found so far are returned. The budgets default to those of the explainer.
+
+        search_info is returned last if return_search_info is set (and kept in self.search_info) with:
+            truncated           whether the budget ran out before the search finished
+            num_evaluated       candidates evaluated
+            num_pruned          candidates skipped by minimality pruning
+            num_cfx_candidates  candidates at every depth searched
+            depth               deepest depth reached
+            coverage            fraction of the candidates the full search would have considered, a lower bound
+                                taken over every depth up to max_depth when truncated
+        '''
+        explanations = self.iter_explain(
+            query,
+            max_depth=max_depth,
+            visualise=visualise,
+            visualise_only_valid=visualise_only_valid,
+            visualised_interventions=visualised_interventions,
+            time_budget=time_budget,
+            candidate_budget=candidate_budget,
+        )
+        # The search stops at the first depth with explanations, so they are aggregated together
+        explanations = self.aggregate_explanations(list(explanations))
+        sum_cfx_candidates = self.search_info["num_cfx_candidates"]
+    
+        if return_cfx_candidates_nums and return_search_info:
+            return explanations,sum_cfx_candidates,self.search_info
+        elif return_cfx_candidates_nums:
+            return explanations,sum_cfx_candidates
+        elif return_search_info:
+            return explanations,self.search_info
+        else:
+            # To fix compatability issues
+            return explanations
+
+    def iter_explain(
+            self,
+            query:CounterfactualQuery,
+            max_depth:int = None,
+            visualise:bool = False,
+            visualise_only_valid:bool =False,
+            visualised_interventions: list = None,
+            time_budget:float = None,
+            candidate_budget:int = None,
+            aggregate:bool = False,
+    ) -> Iterator[CounterfactualExplanation]:
+        '''
+        Yield explanations as soon as they are found, with the same search as explain. If aggregate is set, the
+        aggregated explanation of every new group is yielded instead, and it gains the values of the later
+        explanations in its group as the search continues. self.search_info is set once the search finishes
+        '''
+        self.validate_query(query)
 
         # Start by constructing a new graph only of ancestors to the node in question
         search_space = self.reduce_model(query)
@@ -281,25 +549,55 @@ class Explainer:
         else:
             max_depth = min(max_depth,len(search_space.keys()))
 
-        explanations = []
+        budget = SearchBudget(
+            time_limit=time_budget if time_budget is not None else self.time_budget,
+            max_candidates=candidate_budget if candidate_budget is not None else self.candidate_budget,
+        )
+        num_pruned = self.num_pruned
+        aggregator = ExplanationAggregator()
+
+        num_explanations = 0
         sum_cfx_candidates = 0
+        refuted = set() # Combinations of variables with no intervention that satisfies the query
+        if not query.satisfies_query(self.model.state):
+            refuted.add(frozenset())
+        reusable = {} # Values changed by the interventions of the previous depth
+        depth = 0
         for i in range(max_depth):
-            new_exps,num_cfx_candidates = self.explain_to_depth(query=query,search_space=search_space,depth=i+1,search_graph=search_graph,visualise=visualise,visualise_only_valid=visualise_only_valid,visualised_interventions=visualised_interventions)
-            sum_cfx_candidates += num_cfx_candidates
-
-            # Aggregate
-            new_exps = self.aggregate_explanations(new_exps)
-
-            explanations += new_exps
-
-            if len(explanations) > 0:
+            depth = i+1
+            sum_cfx_candidates += self.count_combinations(search_space=search_space,N=depth)
+            for exp in self.iter_depth(query=query,search_space=search_space,depth=depth,search_graph=search_graph,visualise=visualise,visualise_only_valid=visualise_only_valid,visualised_interventions=visualised_interventions,refuted=refuted,reusable=reusable,budget=budget):
+                num_explanations += 1
+                if not aggregate:
+                    yield exp
+                    continue
+                aggregated,new = aggregator.add(exp)
+                if new:
+                    yield aggregated
+
+            if num_explanations > 0 or budget.truncated:
                 break
-    
-        if return_cfx_candidates_nums:
-            return explanations,sum_cfx_candidates
-        else:
-            # To fix compatability issues
-            return explanations
+
+        num_pruned = self.num_pruned - num_pruned
+        coverage = 1.0
+        if budget.truncated:
+            self.num_truncated += 1
+            total = sum(self.count_combinations(search_space,d) for d in range(1,max_depth+1))
+            coverage = (budget.num_candidates + num_pruned) / total
+        self.search_info = {
+            "truncated":budget.truncated,
+            "num_evaluated":budget.num_candidates,
+            "num_pruned":num_pruned,
+            "num_cfx_candidates":sum_cfx_candidates,
+            "depth":depth,
+            "coverage":coverage,
+        }
+
+    def aiter_explain(self,query:CounterfactualQuery,**kwargs) -> AsyncIterator[CounterfactualExplanation]:
+        '''
+        Asynchronous version of iter_explain, searching in a worker thread so the event loop is not blocked
+        '''
+        return iterate_in_thread(self.iter_explain(query,**kwargs))
 
     def explain_to_depth(
             self,
@@ -309,11 +607,74 @@ class Explainer:
             search_graph:nx.DiGraph,
             visualise:bool=False,
             visualise_only_valid:bool=False,
-            visualised_interventions:list=None
+            visualised_interventions:list=None,
+            refuted:set=None,
+            reusable:dict=None,
+            budget:SearchBudget=None,
     ):
-        search_combos = self.generate_combinations(search_space=search_space,N=depth)
+        '''
+        Evaluate every intervention changing depth variables. If refuted holds the combinations of variables already
+        refuted at lower depths, combinations that cannot improve on them are pruned, and refuted is updated.
+        If reusable holds the values changed by the interventions of the previous depth, interventions extending
+        them only propagate the extra variable, and reusable is replaced by the values changed at this depth.
+        If a budget is given, evaluation stops once it runs out
+        '''
+        explanations = list(self.iter_depth(
+            query=query,
+            search_space=search_space,
+            depth=depth,
+            search_graph=search_graph,
+            visualise=visualise,
+            visualise_only_valid=visualise_only_valid,
+            visualised_interventions=visualised_interventions,
+            refuted=refuted,
+            reusable=reusable,
+            budget=budget,
+        ))
+        return explanations,self.count_combinations(search_space=search_space,N=depth)
+
+    def iter_depth(
+            self,
+            query:CounterfactualQuery,
+            search_space:Dict[str,list],
+            depth:int,
+            search_graph:nx.DiGraph,
+            visualise:bool=False,
+            visualise_only_valid:bool=False,
+            visualised_interventions:list=None,
+            refuted:set=None,
+            reusable:dict=None,
+            budget:SearchBudget=None,
+    ) -> Iterator[CounterfactualExplanation]:
+        '''
+        Yield the explanations of explain_to_depth as they are found. refuted and reusable are only updated once
+        every candidate has been evaluated
+        '''
+        pruned = []
+        skip = None
+        if refuted is not None:
+            def skip(var_combination):
+                if self.prunable(var_combination,refuted,query,search_graph):
+                    pruned.append(var_combination)
+                    return True
+                return False
+
+        search_combos = self.generate_combinations(search_space=search_space,N=depth,skip=skip)
+        if budget is not None:
+            search_combos = budget.take(search_combos)
+
+        if self.backend != "serial" and not visualise:
+            explanations = []
+            for explanation in self.evaluate_parallel(query,search_combos,search_graph):
+                explanations.append(explanation)
+                yield explanation
+            self.record_refuted(explanations,search_space,depth,pruned,refuted,budget)
+            return
 
         explanations = []
+        state_key = self.model.state_fingerprint() if self.model.memo.maxsize > 0 else None
+        reuse = reusable is not None and self.reuse_budget > 0 and not visualise
+        stored = {}
         for combo in search_combos:
             '''
             if "BaseUserAccuracy_0" not in combo:
@@ -324,13 +685,27 @@ class Explainer:
             print([f"{self.node_names[edge[0]]}:{self.node_names[edge[1]]}" for edge in accuracy_seed_edges])
             '''
 
-            new_graph,new_state = self.model.intervene(combo,search_graph)
+            if visualise:
+                new_graph,new_state = self.model.intervene(combo,search_graph,overlay=self.overlay)
+                foil_values = new_state.get_values(query.foil_vars())
+            elif reuse:
+                # Combinations are generated in order, so all but the last variable form an intervention of the previous depth
+                items = tuple((var,value_key(val)) for var,val in combo.items())
+                base = None
+                if items[:-1] in reusable:
+                    base = (dict(list(combo.items())[:-1]),reusable[items[:-1]])
+                changed = self.model.intervene_changes(combo,search_graph,state_key=state_key,overlay=self.overlay,base=base)
+                foil_values = self.model.changed_values(changed,query.foil_vars())
+                if len(stored) < self.reuse_budget:
+                    stored[items] = changed
+            else:
+                foil_values = self.model.intervene_foils(combo,search_graph,query.foil_vars(),state_key=state_key,overlay=self.overlay)
 
             satisfied = False
             
-            if query.satisfies_query(new_state):
+            if query.satisfies_values(foil_values,self.model.state.range_dict):
                 satisfied = True
-                explanations.append(CounterfactualExplanation(combo,new_state.get_values(query.foil_vars()),self.model.state,query.tick,query.time))
+                explanations.append(CounterfactualExplanation(combo,foil_values,self.model.state,query.tick,query.time))
 
             if visualise:
                 display_this = True
@@ -349,45 +724,183 @@ class Explainer:
                 
                 if display_this:
                     self.visualise_intervention(combo,new_graph,new_state,query,search_space)
+
+            if satisfied:
+                yield explanations[-1]
         
-        return explanations,len(search_combos)
+        if reuse:
+            reusable.clear()
+            reusable.update(stored)
+        self.record_refuted(explanations,search_space,depth,pruned,refuted,budget)
+
+    def record_refuted(self,explanations:List[CounterfactualExplanation],search_space:Dict[str,list],depth:int,pruned:list,refuted:set,budget:SearchBudget=None):
+        self.num_pruned += sum(self.count_combinations({var:search_space[var] for var in var_combination},depth) for var_combination in pruned)
+        if refuted is None or (budget is not None and budget.truncated):
+            # Combinations are only refuted once every intervention on them has been evaluated
+            return
+        satisfied = {frozenset(exp.reason.keys()) for exp in explanations}
+        for var_combination in itertools.combinations(search_space.keys(),depth):
+            var_set = frozenset(var_combination)
+            if var_set not in satisfied:
+                refuted.add(var_set)
     
-    def aggregate_explanations(self,explanations:List[CounterfactualExplanation]):
+    def evaluate_parallel(self,query:CounterfactualQuery,search_combos,search_graph:nx.DiGraph) -> Iterator[CounterfactualExplanation]:
+        '''
+        Evaluate candidate interventions in chunks on the thread or process pool, yielding explanations in the order
+        of the serial search
+        '''
+        # Compile the propagation schedule and fingerprints first so that every thread shares them
+        self.model.propagation_schedule(search_graph)
+        self.model.graph_fingerprint(search_graph)
+        state_key = self.model.state_fingerprint() if self.model.memo.maxsize > 0 else None
 
-        # First, group all explanations that share the same variables and foil values
-        grouped_explanations = {}
+        chunks = parallel.chunked(search_combos,self.chunk_size)
+        for chunk,results in self.pool.evaluate(query,search_graph,self.overlay,state_key,chunks):
+            for i,foil_values in results:
+                yield CounterfactualExplanation(chunk[i],foil_values,self.model.state,query.tick,query.time)
+
+    def aggregate_explanations(self,explanations:List[CounterfactualExplanation]):
+        # Group all explanations that share the same variables and foil values
+        aggregator = ExplanationAggregator()
         for exp in explanations:
-            var_key = tuple(sorted(exp.reason.keys()))
-            foil_key = tuple([str(exp.counterfactual_foil[var]) for var in sorted(exp.counterfactual_foil)])
-            if var_key not in grouped_explanations:
-                grouped_explanations[var_key] = {foil_key: [exp]}
+            aggregator.add(exp)
+        return aggregator.explanations()
+
+    '''
+    BATCH
+    '''
+    def explain_batch(
+            self,
+            queries:List[CounterfactualQuery],
+            max_depth:int = None,
+            return_cfx_candidates_nums:bool = False,
+            time_budget:float = None,
+            candidate_budget:int = None,
+    ) -> List[List[CounterfactualExplanation]]:
+        '''
+        Explain several queries about the current state, giving the same explanations as explaining each in turn.
+        Ancestors and search spaces are computed once, and queries whose searches can share a search graph are searched
+        together, evaluating each candidate intervention once against the foils of every query it applies to.
+        The budgets are shared by the batch. Returns the explanations of every query, and their numbers of candidates
+        if requested
+
+        Grouping only saves time when queries have the same search space, such as decisions of nodes that share their
+        causes. Queries with different search spaces are searched one after the other, so a batch of them runs at about
+        the speed of explaining each in turn, as it did for the decisions of the random domain logs
+        '''
+        for query in queries:
+            self.validate_query(query)
+
+        budget = SearchBudget(
+            time_limit=time_budget if time_budget is not None else self.time_budget,
+            max_candidates=candidate_budget if candidate_budget is not None else self.candidate_budget,
+        )
+
+        # Group queries with the same search space whose searches can be shared
+        ancestor_cache = {}
+        value_cache = {}
+        groups = []
+        for i,query in enumerate(queries):
+            search_space = self.reduce_model(query,ancestor_cache=ancestor_cache,value_cache=value_cache)
+            member = (query,search_space,set().union(*[ancestor_cache[node] for node in query.foils]))
+            for group in groups:
+                # Order matters, as it decides the order of the search
+                if list(group["search_space"].items()) == list(search_space.items()) and all(self.shareable(member,other) for other in group["members"]):
+                    group["members"].append(member)
+                    group["indices"].append(i)
+                    break
             else:
-                if foil_key not in grouped_explanations[var_key]:
-                    grouped_explanations[var_key][foil_key] = [exp]
-                else:
-                    grouped_explanations[var_key][foil_key].append(exp)
-
-        # Create a new aggregated explanation for each group
-        new_explanations = []
-        for intervention in grouped_explanations:
-            for foil_value in grouped_explanations[intervention]:
-                intervention_dict = {}
-                for exp in grouped_explanations[intervention][foil_value]:
-                    for var in exp.counterfactual_intervention:
-                        if var not in intervention_dict:
-                            intervention_dict[var] = [exp.counterfactual_intervention[var]]
-                        else:
-                            intervention_dict[var].append(exp.counterfactual_intervention[var])
-                
-                foil = grouped_explanations[intervention][foil_value][0].counterfactual_foil
-                state = grouped_explanations[intervention][foil_value][0].state
-                tick = grouped_explanations[intervention][foil_value][0].tick
-                time = grouped_explanations[intervention][foil_value][0].time
+                groups.append({"search_space":search_space,"members":[member],"indices":[i]})
+
+        results = [None]*len(queries)
+        for group in groups:
+            queries_in_group = [query for query,_,_ in group["members"]]
+            for i,result in zip(group["indices"],self.explain_group(queries_in_group,group["search_space"],max_depth,budget)):
+                results[i] = result
+        self.num_truncated += sum(1 for result in results if result[2])
 
-                aggregated_exp = AggregatedCounterfactualExplanation(intervention_dict,foil,state,tick,time)
-                new_explanations.append(aggregated_exp)
+        if return_cfx_candidates_nums:
+            return [result[0] for result in results],[result[1] for result in results]
+        return [result[0] for result in results]
+
+    def shareable(self,member:tuple,other:tuple) -> bool:
+        '''
+        Two queries can be searched on one graph holding the search space and both sets of foils, as long as neither
+        has a foil variable outside the search space that affects the foils of the other. The other query would
+        treat that variable as fixed. Members are (query, search space, ancestors of the foils)
+        '''
+        for (query,_,_),(_,search_space,ancestors) in [(member,other),(other,member)]:
+            for node in query.foils:
+                if node in ancestors and node not in search_space:
+                    return False
+        return True
 
-        return new_explanations
+    def explain_group(self,queries:List[CounterfactualQuery],search_space:Dict[str,list],max_depth:int,budget:SearchBudget) -> List[tuple[list,int,bool]]:
+        '''
+        Search for explanations of several queries with the same search space at once, returning the aggregated
+        explanations, number of candidates and whether the search was truncated for each
+        '''
+        foil_nodes = dict.fromkeys(node for query in queries for node in query.foils if node not in search_space)
+        search_graph = self.model.graph.subgraph(list(search_space.keys()) + list(foil_nodes))
+        query_graphs = [self.search_graph(query,search_space) for query in queries]
+        if max_depth is None or max_depth > len(search_space):
+            max_depth = len(search_space)
+
+        explanations = [[] for _ in queries]
+        num_cfx = [0 for _ in queries]
+        refuted = [set() for _ in queries]
+        for i,query in enumerate(queries):
+            if not query.satisfies_query(self.model.state):
+                refuted[i].add(frozenset())
+        active = list(range(len(queries)))
+
+        state_key = self.model.state_fingerprint() if self.model.memo.maxsize > 0 else None
+        reuse = self.reuse_budget > 0
+        reusable = {}
+        depth = 0
+        while depth < max_depth and len(active) > 0 and not budget.truncated:
+            depth += 1
+            pruned = {i:[] for i in active}
+            for i in active:
+                num_cfx[i] += self.count_combinations(search_space,depth)
+
+            def candidates():
+                # Yield each intervention with the queries it has to be evaluated for
+                for var_combination in itertools.combinations(search_space.keys(),depth):
+                    targets = []
+                    for i in active:
+                        if self.prunable(var_combination,refuted[i],queries[i],query_graphs[i]):
+                            pruned[i].append(var_combination)
+                        else:
+                            targets.append(i)
+                    if len(targets) == 0:
+                        continue
+                    for values in itertools.product(*[search_space[var] for var in var_combination]):
+                        yield {var:value for var,value in zip(var_combination,values)},targets
+
+            found = {i:[] for i in active}
+            stored = {}
+            for combo,targets in budget.take(candidates()):
+                items = tuple((var,value_key(val)) for var,val in combo.items())
+                base = None
+                if reuse and items[:-1] in reusable:
+                    base = (dict(list(combo.items())[:-1]),reusable[items[:-1]])
+                changed = self.model.intervene_changes(combo,search_graph,state_key=state_key,overlay=self.overlay,base=base)
+                if reuse and len(stored) < self.reuse_budget:
+                    stored[items] = changed
+
+                for i in targets:
+                    foil_values = self.model.changed_values(changed,queries[i].foil_vars())
+                    if queries[i].satisfies_values(foil_values,self.model.state.range_dict):
+                        found[i].append(CounterfactualExplanation(combo,foil_values,self.model.state,queries[i].tick,queries[i].time))
+            reusable = stored
+
+            for i in active:
+                self.record_refuted(found[i],search_space,depth,pruned[i],refuted[i],budget)
+                explanations[i] = self.aggregate_explanations(found[i])
+            active = [i for i in active if len(explanations[i]) == 0]
+
+        return [(explanations[i],num_cfx[i],budget.truncated and i in active) for i in range(len(queries))]
 
     '''
     VISUALISATION
@@ -0,0 +1,135 @@
+import os
+import pickle
+import weakref
+import itertools
+import functools
+import collections
+import multiprocessing
+import networkx as nx
+from concurrent.futures import Executor,ThreadPoolExecutor,ProcessPoolExecutor
+
+from btcm.cm.causalmodel import CausalModel
+
+'''
+Parallel evaluation of counterfactual candidates
+
+Candidates are evaluated in chunks. A chunk evaluates to the index within the chunk and the foil values of every
+candidate that satisfies the query, so that results are small and never include the model state.
+
+A WorkerPool is created once and used for every depth of every query explained on a causal model. Process pools are
+forked, so workers inherit the causal model through init_worker instead of receiving it (the variable functions of
+some states cannot be pickled). The context of an evaluation (the values of the state, query, search graph, overlay
+and state key) is pickled once and sent with its chunks, and workers only unpickle it when it changes.
+'''
+
+BACKENDS = ["serial","thread","process"]
+
+def chunked(iterable,size:int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator,size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def evaluate_chunk(model:CausalModel,query,search_graph:nx.DiGraph,overlay:bool,state_key:str,chunk:list[dict]) -> list[tuple[int,dict]]:
+    results = []
+    for i,combo in enumerate(chunk):
+        foil_values = model.intervene_foils(combo,search_graph,query.foil_vars(),state_key=state_key,overlay=overlay)
+        if query.satisfies_values(foil_values,model.state.range_dict):
+            results.append((i,foil_values))
+    return results
+
+'''
+PROCESS WORKERS
+'''
+worker_model = None # Causal model in each worker process
+worker_context = None # (context id, (query, search_graph, overlay, state_key)) of the last chunk in each worker process
+
+def init_worker(model:CausalModel):
+    global worker_model
+    worker_model = model
+
+def evaluate_chunk_in_worker(context:tuple[int,bytes],chunk:list[dict]) -> list[tuple[int,dict]]:
+    global worker_context
+    context_id,data = context
+    if worker_context is None or worker_context[0] != context_id:
+        vals,query,search_graph,overlay,state_key = pickle.loads(data)
+        worker_model.state.vals.update(vals)
+        worker_context = (context_id,(query,search_graph,overlay,state_key))
+    return evaluate_chunk(worker_model,*worker_context[1],chunk)
+
+class WorkerPool:
+    '''
+    Thread or forked process pool evaluating candidates on a causal model, created at the first evaluation and kept
+    until close() so that every depth of every query reuses the same workers. A pool that is never closed is shut down
+    when it is garbage collected or the interpreter exits
+    '''
+    def __init__(self,model:CausalModel,backend:str,num_workers:int):
+        if backend not in ["thread","process"]:
+            raise ValueError(f"Unknown pool backend {backend}, must be thread or process")
+        self.model = model
+        self.backend = backend
+        self.num_workers = num_workers
+        self.executor = None
+        self.pid = None # Process that created the executor, a forked child has to create its own
+        self.finalizer = None # Shuts down the executor if the pool isn't closed
+        self.num_contexts = 0
+
+    def get_executor(self) -> Executor:
+        if self.executor is None or self.pid != os.getpid():
+            if self.backend == "thread":
+                self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+            else:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=init_worker,
+                    initargs=(self.model,),
+                )
+            self.pid = os.getpid()
+            self.finalizer = weakref.finalize(self,shutdown_executor,self.executor,self.pid)
+        return self.executor
+
+    def evaluate(self,query,search_graph:nx.DiGraph,overlay:bool,state_key:str,chunks):
+        '''
+        Yield (chunk, result of evaluate_chunk) in order for the current state of the model
+        '''
+        executor = self.get_executor()
+        if self.backend == "thread":
+            func = lambda chunk: evaluate_chunk(self.model,query,search_graph,overlay,state_key,chunk)
+        else:
+            self.num_contexts += 1
+            # Search graphs are views of the model graph, so a copy is sent
+            data = pickle.dumps((self.model.state.vals,query,nx.DiGraph(search_graph),overlay,state_key))
+            func = functools.partial(evaluate_chunk_in_worker,(self.num_contexts,data))
+        return ordered_map(executor,func,chunks,max_pending=2*self.num_workers)
+
+    def close(self):
+        if self.finalizer is not None:
+            self.finalizer()
+        self.executor = None
+        self.finalizer = None
+
+def shutdown_executor(executor:Executor,pid:int):
+    # A forked child doesn't own the executors it inherited
+    if pid == os.getpid():
+        executor.shutdown()
+
+'''
+SCHEDULING
+'''
+def ordered_map(executor:Executor,func,chunks,max_pending:int):
+    '''
+    Yield (chunk, result) in submission order, with at most max_pending chunks submitted at once so that
+    chunks are only generated as they are needed
+    '''
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append((chunk,executor.submit(func,chunk)))
+        if len(pending) >= max_pending:
+            chunk,future = pending.popleft()
+            yield chunk,future.result()
+    while pending:
+        chunk,future = pending.popleft()
+        yield chunk,future.result()
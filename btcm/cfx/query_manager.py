@@ -50,6 +50,45 @@ class QueryManager:
     
     def make_follow_up_query(self,foil:dict[str,list],tick:int,time:int):
         return CounterfactualQuery(foil,tick,time)
+
+    def decision_queries(self,tick:int=0,time="end",action_foil_all_but_null:bool=False) -> list[CounterfactualQuery]:
+        '''
+        A query for every decision made in the tick up to the time, asking why it was made rather than any other action
+
+        Note: Manager should already be loaded with the state at the time of the queries
+        '''
+        if time == "end":
+            time = sorted(int(key) for key in self.manager.data[str(tick)].keys())[-1]
+
+        queries = []
+        for var in self.manager.state.vars():
+            if self.manager.state.categories[var] != "Decision":
+                continue
+            updates = self.manager.update_history.get(var,{}).get(str(tick),{})
+            if not any(int(update_time) <= time for update_time in updates):
+                continue
+
+            # The null action can only be removed from the foils if it wasn't the decision made
+            remove = []
+            if action_foil_all_but_null and self.manager.state.get_value(var) != NullAction():
+                remove = [NullAction()]
+            query = self.explainer.construct_query({var:None},tick=tick,time=time,remove=remove)
+            if len(query.foils[var]) > 0:
+                queries.append(query)
+        return queries
+
+    def explain_decisions(
+            self,
+            tick:int=0,
+            time="end",
+            max_depth:int=None,
+            action_foil_all_but_null:bool=False,
+    ) -> tuple[list[CounterfactualQuery],list]:
+        '''
+        Explain every decision made in the tick up to the time as one batch, returning the queries and their explanations
+        '''
+        queries = self.decision_queries(tick,time=time,action_foil_all_but_null=action_foil_all_but_null)
+        return queries,self.explainer.explain_batch(queries,max_depth=max_depth)
     
     '''
     DISPLAY
@@ -2,8 +2,13 @@ import networkx as nx
 from networkx.drawing.nx_pydot import graphviz_layout
 import matplotlib.pyplot as plt
 import copy
+import weakref
+import hashlib
+import threading
+from collections import OrderedDict
 
 from btcm.dm.state import State
+from btcm.dm.action import Action
 
 from collections.abc import Callable
 from typing import List,Dict,Self
@@ -29,6 +34,54 @@ def build_state_model(state:State, edges:list[tuple[str,str]]=None):
 
     return cm
 
+def value_key(value):
+    '''
+    Hashable key for a variable value that is stable across copies of the value
+    '''
+    if isinstance(value,Action):
+        return (Action.__name__,value.name)
+    if isinstance(value,(list,tuple)):
+        return tuple(value_key(val) for val in value)
+    return value
+
+class InterventionMemo:
+    '''
+    Least recently used cache of the values changed by an intervention
+    '''
+    def __init__(self,maxsize:int=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # Shared by thread pool workers
+
+    def get(self,key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self,key,changed:dict):
+        with self.lock:
+            self.entries[key] = changed
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
 class CausalNode:
     def __init__(self,name:str,vals:list,value,func:Callable,category:str="State"):
         self.name = name
@@ -40,11 +93,49 @@ class CausalNode:
     def run(self,state:State):
         return self.func(state=state)
 
+class PropagationSchedule:
+    '''
+    Topological index of a graph with the descendants of every node stored as a bitset over that index,
+    so the propagation order for a set of intervened nodes is the union of their descendant sets in topological order
+    '''
+    def __init__(self,graph:nx.DiGraph):
+        self.order = list(nx.topological_sort(graph))
+        self.index = {node:i for i,node in enumerate(self.order)}
+
+        # Build descendant sets children first
+        self.descendants = {}
+        for node in reversed(self.order):
+            bits = 0
+            for child in graph.successors(node):
+                bits |= (1 << self.index[child]) | self.descendants[child]
+            self.descendants[node] = bits
+
+    def propagation_order(self,nodes:list[str],fixed:list[str]=None) -> list[str]:
+        # Intervened nodes lose their parents, so they are never propagated themselves.
+        # fixed holds any other intervened nodes whose descendants have already been propagated
+        bits = 0
+        for node in nodes:
+            if node in self.descendants:
+                bits |= self.descendants[node]
+        for node in nodes if fixed is None else list(nodes) + list(fixed):
+            if node in self.index:
+                bits &= ~(1 << self.index[node])
+
+        order = []
+        while bits:
+            lowest = bits & -bits
+            order.append(self.order[lowest.bit_length()-1])
+            bits ^= lowest
+        return order
+
 class CausalModel:
-    def __init__(self,state:State):
+    def __init__(self,state:State,memo_size:int=4096):
         self.nodes:Dict[str,CausalNode] = {}
         self.graph = nx.DiGraph()
         self.state = state
+        self.schedules = weakref.WeakKeyDictionary() # Propagation schedule for each search graph
+        self.graph_keys = weakref.WeakKeyDictionary() # Fingerprint of each search graph
+        self.memo = InterventionMemo(maxsize=memo_size) # Values changed by interventions, 0 to disable
 
     '''
     GRAPH OPERATIONS
@@ -93,12 +184,87 @@ class CausalModel:
                     break
         return reduced_order
     
+    def propagation_schedule(self,graph:nx.DiGraph) -> PropagationSchedule:
+        '''
+        Get the propagation schedule of a search graph, compiling it the first time the graph is used.
+        Graphs must not be modified after they have been used for an intervention
+        '''
+        if graph not in self.schedules:
+            self.schedules[graph] = PropagationSchedule(graph)
+        return self.schedules[graph]
+
     def propagate_interventions(self,order:list[str],state:State) -> None:
         for node in order:
             new_val = state.run(node)
             state.set_value(node,new_val)
 
-    def intervene(self,interventions:dict,search_graph:nx.DiGraph) -> tuple[nx.DiGraph,State]:
+    '''
+    MEMOISATION
+    '''
+    def state_fingerprint(self) -> str:
+        '''
+        Fingerprint of the current values of every variable in the model
+        '''
+        values = tuple(value_key(self.state.get_value(node)) for node in self.nodes)
+        return hashlib.sha256(repr(values).encode()).hexdigest()
+
+    def graph_fingerprint(self,graph:nx.DiGraph) -> str:
+        if graph not in self.graph_keys:
+            content = (sorted(graph.nodes),sorted(graph.edges))
+            self.graph_keys[graph] = hashlib.sha256(repr(content).encode()).hexdigest()
+        return self.graph_keys[graph]
+
+    def intervene_foils(self,interventions:dict,search_graph:nx.DiGraph,foil_vars:list[str],state_key:str=None,overlay:bool=True) -> dict:
+        '''
+        Get the values of the foil variables after an intervention, reusing the result of an identical intervention
+        on the same state and search graph. state_key can be given to avoid fingerprinting the state on every call
+        '''
+        if self.memo.maxsize == 0:
+            _,new_state = self.intervene(interventions,search_graph,overlay=overlay)
+            return new_state.get_values(foil_vars)
+
+        changed = self.intervene_changes(interventions,search_graph,state_key=state_key,overlay=overlay)
+        return self.changed_values(changed,foil_vars)
+
+    def intervene_changes(self,interventions:dict,search_graph:nx.DiGraph,state_key:str=None,overlay:bool=True,base:tuple[dict,dict]=None) -> dict:
+        '''
+        Get the values changed by an intervention, memoised as in intervene_foils. base can hold (interventions, changes)
+        for an intervention on a subset of the variables, in which case only the remaining variables are propagated
+        '''
+        key = None
+        if self.memo.maxsize > 0:
+            if state_key is None:
+                state_key = self.state_fingerprint()
+            key = (
+                state_key,
+                self.graph_fingerprint(search_graph),
+                frozenset((node,value_key(val)) for node,val in interventions.items()),
+            )
+            changed = self.memo.get(key)
+            if changed is not None:
+                return changed
+
+        if base is None:
+            _,new_state = self.intervene(interventions,search_graph,overlay=overlay)
+        else:
+            extension = {node:val for node,val in interventions.items() if node not in base[0]}
+            new_state = self.extend_intervention(base[0],base[1],extension,search_graph,overlay=overlay)
+
+        if overlay:
+            # The overlay only holds the intervened and propagated values
+            changed = new_state.vals.maps[0]
+        else:
+            changed = {node:new_state.get_value(node) for node in search_graph.nodes}
+
+        if key is not None:
+            self.memo.put(key,changed)
+        return changed
+
+    def changed_values(self,changed:dict,nodes:list[str]) -> dict:
+        # Variables that were not changed keep their current value
+        return {node:changed[node] if node in changed else self.state.get_value(node) for node in nodes}
+
+    def intervene(self,interventions:dict,search_graph:nx.DiGraph,overlay:bool=True) -> tuple[nx.DiGraph,State]:
         # Validate
         for node in interventions:
             if node not in self.nodes:
@@ -110,7 +276,11 @@ class CausalModel:
         
         # Copy
         new_graph = nx.DiGraph(search_graph)
-        new_state = self.state.copy_state(self.state)
+        if overlay:
+            # Only store the values changed by the intervention
+            new_state = self.state.overlay_state(self.state)
+        else:
+            new_state = self.state.copy_state(self.state)
         
         for node in interventions:
             # Remove parents
@@ -123,11 +293,46 @@ class CausalModel:
             new_state.set_value(node,interventions[node])
 
         # Propagate changes throughout model
-        order = self.propagation_order(list(interventions.keys()),new_graph)
+        order = self.propagation_schedule(search_graph).propagation_order(list(interventions.keys()))
         self.propagate_interventions(order,new_state)
 
         return new_graph,new_state
 
+    def extend_intervention(self,interventions:dict,changed:dict,extension:dict,search_graph:nx.DiGraph,overlay:bool=True) -> State:
+        '''
+        State after intervening on both interventions and extension, starting from the values changed by interventions
+        alone, so that only the descendants of the extension are propagated again
+        '''
+        # Validate
+        for node in extension:
+            if node not in self.nodes:
+                raise ValueError(f"Unrecognised node {node}")
+            
+            if extension[node] not in self.nodes[node].vals:
+                raise ValueError(f"Invalid value {extension[node]} for node {node}")
+
+        # Propagation order, keeping the earlier interventions fixed
+        order = self.propagation_schedule(search_graph).propagation_order(list(extension.keys()),fixed=list(interventions.keys()))
+
+        # Copy, resetting the nodes to propagate as some variables are computed from their own current value
+        reset = set(order)
+        kept = {node:val for node,val in changed.items() if node not in reset}
+        if overlay:
+            new_state = self.state.overlay_state(self.state)
+            new_state.vals.maps[0].update(kept)
+        else:
+            new_state = self.state.copy_state(self.state)
+            for node in kept:
+                new_state.set_value(node,kept[node])
+
+        for node in extension:
+            new_state.set_value(node,extension[node])
+
+        # Propagate changes throughout model
+        self.propagate_interventions(order,new_state)
+
+        return new_state
+
 
     '''
     VISUALISE
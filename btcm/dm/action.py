@@ -7,6 +7,10 @@ class Action:
     
     def __eq__(self, other_action):
         return self.name == other_action.name
+
+    def __hash__(self):
+        # Consistent with __eq__, so equal actions can be used as the same dictionary key
+        return hash(self.name)
     
     @property
     def name(self) -> str:
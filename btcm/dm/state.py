@@ -1,3 +1,5 @@
+import copy
+from collections import ChainMap
 from typing import Self,Dict
 
 from btcm.dm.action import Action
@@ -134,6 +136,16 @@ class State:
     @classmethod
     def copy_state(cls,state:Self) -> Self:
         return cls(values=state.vals)
+
+    @classmethod
+    def overlay_state(cls,state:Self) -> Self:
+        '''
+        Copy of a state whose values read through to the original, with any new values kept in the copy only.
+        Values are shared with the original rather than copied, so they must be replaced and not modified in place
+        '''
+        obj = copy.copy(state)
+        obj.vals = ChainMap({},state.vals)
+        return obj
         
     def __str__(self):
         return str(self.vals)
@@ -11,6 +11,8 @@ from btcm.dm.action import NullAction
 from btcm.bt.nodes import ActionNode,ConditionNode
 
 class RandomActionNode(ActionNode):
+    deterministic = True # Decisions and effects only depend on the inputs, action and seed
+
     def __init__(self,inputs:list[str],direct_outputs:list[str],outputs:list[str],actions:list[RandomAction],seed:int=None,name:str = "RandomActionNode"):
         super(RandomActionNode, self).__init__(name)
         self.id = name
@@ -69,6 +71,8 @@ class RandomActionNode(ActionNode):
         return "Random action node"
     
 class RandomConditionNode(ConditionNode):
+    deterministic = True # Status only depends on the inputs and seed
+
     def __init__(self,inputs:list[str],seed:int=None,name:str="RandomConditionNode"):
         super(RandomConditionNode, self).__init__(name)
         self.id = name
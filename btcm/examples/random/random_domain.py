@@ -1,5 +1,7 @@
 import py_trees
 import time
+import copy
+import functools
 import networkx as nx
 
 from btcm.examples.random.random_state import RandomState
@@ -123,24 +125,38 @@ def make_state(filename,directory:str="logs/random/"):
     cm_connectivity = float(flist[7])
     num_leaves = int(flist[9].split(".")[0])
 
-    state = RandomState(
+    # States are made for every evaluation of a variable, so copy a state built once per configuration, with its own
+    # dictionaries so changing one state doesn't change the others
+    state = copy.copy(initial_state(num_vars,cm_connectivity,seed))
+    state.vals = dict(state.vals)
+    state.range_dict = dict(state.range_dict)
+    state.var_funcs_dict = dict(state.var_funcs_dict)
+    state.func_seeds = dict(state.func_seeds)
+
+    return state
+
+@functools.lru_cache(maxsize=16)
+def initial_state(num_vars:int,connectivity:float,seed:int) -> RandomState:
+    '''
+    State of a configuration, kept for the configurations used most recently. The states copied from it share its
+    variable lists, state graph, variable order and the range and function objects, which are never changed in place
+    '''
+    return RandomState(
         num_vars=num_vars,
-        connectivity=cm_connectivity,
+        connectivity=connectivity,
         top_ratio=0.5,
         internal_ratio=0.25,
         seed=seed,
         visualise=False
     )
 
-    return state
-
 def state_class():
     return RandomState
 
 '''
 RUN TREE
 '''
-def run(tree:py_trees.trees.BehaviourTree,display_tree:bool=False,num_ticks:int=1):
+def run(tree:py_trees.trees.BehaviourTree,display_tree:bool=False,num_ticks:int=1,tick_delay:float=0.1):
     tree.setup()
     curr_tick = 0
     while curr_tick < num_ticks:
@@ -148,7 +164,8 @@ def run(tree:py_trees.trees.BehaviourTree,display_tree:bool=False,num_ticks:int=
             # Tick the tree
             tree.tick()
             # Sleep for a bit to simulate time passing
-            time.sleep(0.1)
+            if tick_delay > 0:
+                time.sleep(tick_delay)
             # Optional, print the tree structure
             if display_tree:
                 print(py_trees.display.unicode_tree(tree.root, show_status=True))
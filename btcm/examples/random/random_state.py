@@ -8,6 +8,26 @@ import matplotlib.pyplot as plt
 from btcm.dm.state import State,VarRange
 from btcm.dm.action import Action,NullAction
 
+class BooleanFunction:
+    '''
+    Compiled boolean function of a random variable, folding its parents left to right with AND (True in ops) or OR
+    '''
+    def __init__(self,parents:list[str],ops:list[bool]):
+        self.parents = parents
+        self.ops = ops
+
+    def evaluate(self,values:dict):
+        combined_value = values[self.parents[0]]
+        for parent,op in zip(self.parents[1:],self.ops):
+            if op:
+                combined_value = combined_value & values[parent]
+            else:
+                combined_value = combined_value | values[parent]
+        return combined_value
+
+    def __call__(self,state:State):
+        return self.evaluate(state.vals)
+
 class RandomState(State):
     def __init__(
             self,
@@ -42,6 +62,8 @@ class RandomState(State):
         # Initialise state dictionaries
         self.range_dict = self.random_range_dict()
         self.var_funcs_dict,self.func_seeds = self.random_var_funcs()
+        self.var_order = list(nx.topological_sort(self.state_graph))
+        self.default_vals = None # Computed on first use
 
         # Initialise state
         self.set_initial_values()
@@ -126,18 +148,10 @@ class RandomState(State):
             var_parents = list(self.state_graph.predecessors(var))
             func_seeds[var] = rng.integers(0, 10000)
             if len(var_parents) > 0:
-                def child_func(state:Self,var:str=var,var_parents:list[str]=var_parents):
-                    rng_child = np.random.default_rng(state.func_seeds[var])
-                    combined_value = state.get_value(var_parents[0])
-                    
-                    for parent in var_parents[1:]:
-                        if rng_child.choice([True, False]):
-                            combined_value = combined_value and state.get_value(parent)
-                        else:
-                            combined_value = combined_value or state.get_value(parent)
-                    return combined_value
-
-                func_dict[var] = child_func
+                # Draw whether each parent is combined with AND or OR once, rather than on every evaluation
+                rng_child = np.random.default_rng(func_seeds[var])
+                ops = [bool(rng_child.choice([True, False])) for _ in var_parents[1:]]
+                func_dict[var] = BooleanFunction(var_parents,ops)
 
         return func_dict,func_seeds
     
@@ -152,12 +166,10 @@ class RandomState(State):
 
 
     def propagate_internal_values(self):
-        order = nx.topological_sort(self.state_graph)
-        for node in order:
+        for node in self.var_order:
             new_value = self.run(node,self)
             self.set_value(node, new_value)
-            
-    
+
     '''
     Variable Info
     '''
@@ -196,13 +208,14 @@ class RandomState(State):
     '''
     def default_values(self):
         # Should be consistent across all seeds
-        rng = np.random.default_rng(42)
+        if self.default_vals is None:
+            rng = np.random.default_rng(42)
 
-        default_vals = {}
-        for var in self.var_list:
-            default_vals[var] = bool(rng.choice(self.range_dict[var].values))
+            self.default_vals = {}
+            for var in self.var_list:
+                self.default_vals[var] = bool(rng.choice(self.range_dict[var].values))
 
-        return default_vals
+        return dict(self.default_vals)
 
                
     '''
@@ -1,6 +1,6 @@
 import py_trees
 
-from btcm.bt.btstate import BTStateManager
+from btcm.bt.btstate import BTStateManager,BTTemplate
 from btcm.cfx.explainer import Explainer
 from btcm.cfx.query_manager import QueryManager
 from btcm.cfx.comparer import Comparer
@@ -66,10 +66,18 @@ def compare_runs(
         visualise: bool = False,
         visualise_only_valid: bool = False,
         hide_display: bool = False,
+        template1: BTTemplate = None,
+        template2: BTTemplate = None,
 ):
-    # Reconstruct BT
-    manager1 = BTStateManager(file1,dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir1)
-    manager2 = BTStateManager(file2,dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir2)
+    # Reconstruct BT, reusing the BT and causal model of a template when one is given
+    if template1 is None:
+        manager1 = BTStateManager(file1,dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir1)
+    else:
+        manager1 = template1.load(file1,dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir1)
+    if template2 is None:
+        manager2 = BTStateManager(file2,dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir2)
+    else:
+        manager2 = template2.load(file2,dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir2)
 
     # Compare
     comparer = Comparer(manager1,manager2)
@@ -0,0 +1,54 @@
+import argparse
+import json
+from pathlib import Path
+
+from btcm.bt.columnar_log import convert_log
+
+def is_log(file:Path) -> bool:
+    # Skip the header.json of columnar logs written by earlier conversions
+    if any(parent.suffix == ".btlog" for parent in file.parents):
+        return False
+    # Skip other json lines files in log directories (such as the status of a random_tests.py sweep)
+    if file.suffix == ".jsonl":
+        with open(file, 'r') as f:
+            try:
+                return "tree" in json.loads(f.readline())
+            except json.JSONDecodeError:
+                return False
+    return True
+
+if __name__ == "__main__":
+    '''
+    Parse Arguments
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help="Log files, or directories to search for json/jsonl logs")
+    parser.add_argument('-o', '--out_dir', type=str, default=None, help="Directory for the columnar logs, by default next to the originals")
+    parser.add_argument('--skip_existing', action='store_true')
+    args = parser.parse_args()
+
+    '''
+    Find Logs
+    '''
+    files = []
+    for path in args.paths:
+        path = Path(path)
+        if path.is_dir():
+            files += [f for f in sorted(path.rglob("*.json")) + sorted(path.rglob("*.jsonl")) if is_log(f)]
+        else:
+            files.append(path)
+
+    '''
+    Convert
+    '''
+    for i,file in enumerate(files):
+        if args.out_dir is None:
+            directory = file.with_suffix(".btlog")
+        else:
+            directory = Path(args.out_dir) / f"{file.stem}.btlog"
+
+        if args.skip_existing and (directory / "header.json").exists():
+            continue
+
+        print(f"{i+1}/{len(files)}: Converting {file} to {directory}")
+        convert_log(str(file),str(directory))
@@ -2,6 +2,8 @@ import argparse
 from os import walk
 import csv
 
+from btcm.bt.btstate import BTTemplate
+from btcm.examples.cognitive_sequence.dummy_env import DummyCognitiveSequenceEnvironment
 from btcm.experiment import cognitive_sequence_experiment
 from btcm.experiment.cognitive_sequence_explainer import compare_runs
 
@@ -54,6 +56,11 @@ if __name__ == "__main__":
             continue
         seed_dict[seed].append(file2)
 
+    # Every log of a profile comes from the same tree, so build its BT and causal model once
+    first_seed = list(seed_dict.keys())[0]
+    template1 = BTTemplate.from_file(seed_dict[first_seed][0],dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir1)
+    template2 = BTTemplate.from_file(seed_dict[first_seed][1],dummy_env=DummyCognitiveSequenceEnvironment(),directory=log_dir2)
+
     # RUN
     founds = []
     depths = []
@@ -81,6 +88,8 @@ if __name__ == "__main__":
             visualise=args.visualise,
             visualise_only_valid=args.visualise_only_valid,
             hide_display=args.hide_display,
+            template1=template1,
+            template2=template2,
         )
 
         founds.append(found)
@@ -1,13 +1,36 @@
-import os
+import argparse
 import csv
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor,as_completed
 
-from btcm.bt.btstate import BTStateManager
+from btcm.bt.btstate import BTTemplate
+from btcm.bt.nodes import Leaf,cache_hit_rate
 from btcm.cfx.comparer import Comparer
 from btcm.examples.random.random_domain import reconstruct_random_tree,make_state,state_class
 
+'''
+Explains the differences between the random domain executions of a sweep in parallel
+
+Every comparison of the default execution of a tree with one of its interventions is a job. The pending jobs of a tree
+are run together by a worker of a process pool, so that the BT and causal model of the tree are only built once.
+Each result row is appended to the results csv as soon as its tree finishes, so a sweep that is stopped or crashes
+can be run again and only runs the comparisons that are not in the csv yet.
+'''
+
+FIELDS = [
+    "seed","num_vars","cm_connectivity","num_leaves","change","found","depth","num_explanations","num_cm_nodes",
+    "time","num_cfx","num_pruned","num_truncated","msg","cache_hit_rate",
+]
+KEY_FIELDS = ["seed","num_vars","cm_connectivity","num_leaves","change"] # Identify the comparison of a row
+
 def load_runs(directory):
     runs = {}
     for filename in os.listdir(directory):
+        # Only the execution logs, not the status of the sweep that produced them
+        if not (filename.startswith("random_") and filename.endswith(".json")):
+            continue
         flist = filename.split("_")
         run_name = flist[1]
         seed = int(flist[3])
@@ -28,19 +51,172 @@ def load_runs(directory):
         runs[seed][num_vars][cm_connectivity][num_leaves][run_name] = filename
     return runs
 
+'''
+JOBS
+'''
+def comparison_jobs(runs:dict) -> list[dict]:
+    '''
+    Every comparison of a default execution with one of its interventions
+    '''
+    jobs = []
+    for seed in runs:
+        for num_vars in runs[seed]:
+            for cm_connectivity in runs[seed][num_vars]:
+                for num_leaves in runs[seed][num_vars][cm_connectivity]:
+                    files = runs[seed][num_vars][cm_connectivity][num_leaves]
+                    for change in files:
+                        if change == "default":
+                            continue
+                        jobs.append({
+                            "seed":seed,
+                            "num_vars":num_vars,
+                            "cm_connectivity":cm_connectivity,
+                            "num_leaves":num_leaves,
+                            "change":change,
+                            "default_file":files["default"],
+                            "change_file":files[change],
+                        })
+    return jobs
+
+def job_key(row:dict) -> tuple:
+    # Rows read back from the csv hold strings, so keys are compared as they are written
+    return tuple(str(row[field]) for field in KEY_FIELDS)
+
+def load_template(default_file:str,directory:str) -> BTTemplate:
+    # Every change is a run of the same tree, so the BT and causal model are only built once
+    return BTTemplate.from_file(
+        default_file,
+        directory=directory,
+        reconstruct_func=reconstruct_random_tree,
+        make_state_func=make_state,
+        state_class_func=state_class,
+        no_env=True,
+    )
+
+def compare(template:BTTemplate,job:dict,settings:dict) -> dict:
+    '''
+    Explain the differences between the default execution and the change of a job, returning its result row
+    '''
+    directory = settings["directory"]
+
+    # The leaves are shared by every comparison of the tree, so only count the cache hits of this one (the rate is left
+    # empty if no leaf was evaluated)
+    leaves = [behaviour for behaviour in template.behaviours.values() if isinstance(behaviour,Leaf)]
+    for leaf in leaves:
+        leaf.reset_cache_counts()
+
+    # Initialise managers
+    manager1 = template.load(job["default_file"], directory=directory)
+    manager2 = template.load(job["change_file"], directory=directory)
+
+    # Initialise comparer
+    comparer = Comparer(manager1,manager2,explainer_args={"time_budget":settings["time_budget"],"candidate_budget":settings["candidate_budget"]})
+
+    # Compare
+    found,depth,num_exps,num_cm_nodes,time,num_cfx,msg = comparer.explain_follow_ups(
+        target_var=job["change"],
+        max_follow_ups=settings["max_follow_ups"],
+        max_depth=job["num_vars"],
+        visualise=settings["visualise"],
+        visualise_only_valid=settings["visualise_only_valid"],
+        hide_display=settings["hide_display"]
+    )
+
+    return {
+        "seed":job["seed"],
+        "num_vars":job["num_vars"],
+        "cm_connectivity":job["cm_connectivity"],
+        "num_leaves":job["num_leaves"],
+        "change":job["change"],
+        "found":found,
+        "depth":depth,
+        "num_explanations":num_exps,
+        "num_cm_nodes":num_cm_nodes,
+        "time":time,
+        "num_cfx":num_cfx,
+        "num_pruned":comparer.num_pruned,
+        "num_truncated":comparer.num_truncated,
+        "msg":msg,
+        "cache_hit_rate":cache_hit_rate(leaves) if any(leaf.cache_hits + leaf.cache_misses > 0 for leaf in leaves) else None,
+    }
+
+def tree_jobs(jobs:list[dict]) -> list[list[dict]]:
+    # Jobs grouped by the tree they compare, in order
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job["default_file"],[]).append(job)
+    return list(groups.values())
+
+def run_jobs(jobs:list[dict],settings:dict) -> list[tuple[dict,dict,str]]:
+    '''
+    Run the jobs of a tree in a worker, returning the row of every job, or its error rather than raising so one
+    failure doesn't stop the sweep
+    '''
+    try:
+        template = load_template(jobs[0]["default_file"],settings["directory"])
+    except Exception:
+        error = traceback.format_exc()
+        return [(job,None,error) for job in jobs]
+
+    results = []
+    for job in jobs:
+        try:
+            results.append((job,compare(template,job,settings),None))
+        except Exception:
+            results.append((job,None,traceback.format_exc()))
+    return results
+
+'''
+RESULTS
+'''
+def read_results(filepath:str) -> tuple[list[str],set[tuple]]:
+    '''
+    Header and keys of the finished comparisons of a results csv, ignoring a row that was only partially written
+    '''
+    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        return None,set()
+
+    with open(filepath, mode='r', newline='') as file:
+        lines = file.read().splitlines(keepends=True)
+    if not lines[-1].endswith("\n"):
+        lines = lines[:-1]
+
+    reader = csv.DictReader(lines)
+    keys = {job_key(row) for row in reader}
+    return reader.fieldnames,keys
+
+def drop_partial_row(filepath:str):
+    '''
+    Cut a row that was only partially written from the end of a results csv, so new rows start on a line of their own
+    '''
+    with open(filepath, 'rb') as file:
+        content = file.read()
+    if content and not content.endswith(b"\n"):
+        # A single truncation, so the finished rows are kept even if it is interrupted
+        os.truncate(filepath, content.rfind(b"\n")+1)
 
 if __name__ == "__main__":
-    # Load all runs into a dictionary
-    runs = load_runs("logs/random/")
+    '''
+    Parse Arguments
+    '''
+    parser = argparse.ArgumentParser(description="Explain the differences between the random domain executions of a sweep in parallel")
+    parser.add_argument('--directory', type=str, default="logs/random")
+    parser.add_argument('--results', type=str, default="results/results_random.csv")
+    parser.add_argument('--num_workers', type=int, default=1, help="Workers running comparisons at once, the time column is only comparable to a serial run with 1")
+    parser.add_argument('--overwrite', action='store_true', help="Start a new results file instead of resuming the existing one")
+    args = parser.parse_args()
 
     # Comparison parameters
-    max_follow_ups = 2
-    # max_depth = 2
-    visualise = False
-    visualise_only_valid = False
-    hide_display = True
-
-    save_data = []
+    settings = {
+        "directory":args.directory,
+        "max_follow_ups":2,
+        "visualise":False,
+        "visualise_only_valid":False,
+        "hide_display":True,
+        # Limits on the seconds and candidates spent on each query, None for no limit
+        "time_budget":None,
+        "candidate_budget":None,
+    }
 
     # Set to true to test a particular execution rather than the entire dataset
     particular_execution = False
@@ -52,88 +228,61 @@ if __name__ == "__main__":
         "target":"T3",
     }
 
+    # Load all runs into a dictionary
+    runs = load_runs(args.directory)
+    jobs = comparison_jobs(runs)
+
     if particular_execution:
-        hide_display = False
-    
-    # Run comparison
-    for seed in runs:
-        for num_vars in runs[seed]:
-            for cm_connectivity in runs[seed][num_vars]:
-                for num_leaves in runs[seed][num_vars][cm_connectivity]:
-                    if particular_execution:
-                        if not(seed == ped["seed"] and num_vars == ped["num_vars"] and cm_connectivity == ped["connectivity"] and num_leaves == ped["num_leaves"]):
-                            continue
-                    print(f"Seed: {seed}, Num Vars: {num_vars}, Connectivity: {cm_connectivity}, Num Leaves: {num_leaves}")
-                    
-                    default_file = runs[seed][num_vars][cm_connectivity][num_leaves]["default"]
-                    other_changes = [f for f in runs[seed][num_vars][cm_connectivity][num_leaves] if f != "default"]
-                    
-                    for change in other_changes:
-                        if particular_execution:
-                            if change != ped["target"]:
-                                continue
-                                
-
-                        change_file = runs[seed][num_vars][cm_connectivity][num_leaves][change]
-                        print(f"\tComparing {default_file} with {change_file}")
-
-                        # Initialise managers
-                        manager1 = BTStateManager(
-                            default_file, 
-                            directory="logs/random", 
-                            reconstruct_func=reconstruct_random_tree,
-                            make_state_func=make_state,
-                            state_class_func=state_class,
-                            no_env=True,
-                        )
-                        manager2 = BTStateManager(
-                            change_file, 
-                            directory="logs/random", 
-                            reconstruct_func=reconstruct_random_tree,
-                            make_state_func=make_state,
-                            state_class_func=state_class,
-                            no_env=True,
-                        )
-
-                        # Initialise comparer
-                        comparer = Comparer(manager1,manager2)
-
-                        # Compare
-                        target_var = change
-                        found,depth,num_exps,num_cm_nodes,time,num_cfx,msg = comparer.explain_follow_ups(
-                            target_var=target_var,
-                            max_follow_ups=max_follow_ups,
-                            max_depth=num_vars,
-                            visualise=visualise,
-                            visualise_only_valid=visualise_only_valid,
-                            hide_display=hide_display
-                        )
-
-                        # Save
-                        save_data.append(
-                            {
-                                "seed":seed,
-                                "num_vars":num_vars,
-                                "cm_connectivity":cm_connectivity,
-                                "num_leaves":num_leaves,
-                                "change":change,
-                                "found":found,
-                                "depth":depth,
-                                "num_explanations":num_exps,
-                                "num_cm_nodes":num_cm_nodes,
-                                "time":time,
-                                "num_cfx":num_cfx,
-                                "msg":msg,
-                            }
-                        )
-
-    # Save data
-    if not particular_execution:
-        csv_file = f'results/results_random.csv'
-        with open(csv_file, mode='w', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=list(save_data[0].keys()))
+        # Run in this process with the display, without saving
+        settings["hide_display"] = False
+        for job in jobs:
+            if (job["seed"],job["num_vars"],job["cm_connectivity"],job["num_leaves"],job["change"]) == (ped["seed"],ped["num_vars"],ped["connectivity"],ped["num_leaves"],ped["target"]):
+                print(f"Comparing {job['default_file']} with {job['change_file']}")
+                template = load_template(job["default_file"],args.directory)
+                print(compare(template,job,settings))
+        exit()
+
+    '''
+    Jobs
+    '''
+    if args.overwrite and os.path.exists(args.results):
+        os.remove(args.results)
+    header,finished = read_results(args.results)
+    if header is not None and not set(header) <= set(FIELDS):
+        raise ValueError(f"{args.results} has the columns {header} rather than {FIELDS}, pass --overwrite to start a new results file")
+    if header is not None and header != FIELDS:
+        # Rows are appended in the columns of the existing file, without the columns added since it was started
+        print(f"{args.results} was started before the columns {[field for field in FIELDS if field not in header]} were added, so they are not recorded")
+
+    pending = [job for job in jobs if job_key(job) not in finished]
+    print(f"{len(jobs)} comparisons, {len(jobs)-len(pending)} already in {args.results}, {len(pending)} to run on {args.num_workers} workers")
+
+    '''
+    Execution
+    '''
+    start = time.perf_counter()
+    num_failed = 0
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    if header is not None:
+        drop_partial_row(args.results)
+    with open(args.results, mode='a', newline='') as file, ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        writer = csv.DictWriter(file, fieldnames=header or FIELDS, extrasaction="ignore")
+        if header is None:
             writer.writeheader()
-            writer.writerows(save_data)
+            file.flush()
+
+        futures = [executor.submit(run_jobs,group,settings) for group in tree_jobs(pending)]
+        counter = 0
+        for future in as_completed(futures):
+            for job,row,error in future.result():
+                counter += 1
+                if row is None:
+                    # Failed comparisons have no row, so they run again when the sweep is resumed
+                    num_failed += 1
+                    print(f"{counter}/{len(pending)}: Comparing {job['default_file']} with {job['change_file']} failed\n{error}")
+                    continue
+                writer.writerow(row)
+                print(f"{counter}/{len(pending)}: Compared {job['default_file']} with {job['change_file']}: {row['msg']}")
+            file.flush()
 
-                        
-                        
\ No newline at end of file
+    print(f"Finished {len(pending)-num_failed}/{len(pending)} comparisons in {time.perf_counter()-start:.1f}s")
@@ -1,8 +1,22 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor,as_completed
+
 from btcm.bt.logger import Logger
-from btcm.examples.random.random_state import RandomState
-from btcm.examples.random.random_bt import random_bt
 from btcm.examples.random import random_domain
 
+'''
+Runs the random domain executions of a sweep in parallel
+
+The parameter grids of the sweep are read from a json config file (see random_tests.json). Each grid lists the values
+of every parameter, and the sweep runs the default execution of every combination plus one execution with an
+intervention on each top variable. Every finished or failed job is appended to a status file in the log directory,
+so a sweep that is stopped or crashes can be run again and only runs the jobs that have not finished.
+'''
+
 def run(
         seed:int,
         num_vars:int,
@@ -10,15 +24,12 @@ def run(
         num_leaves:int,
         top_ratio:float=0.5,
         internal_ratio:float=0.25,
-        itervention:str = None,
+        intervention:str = None,
         run_name:str = "default",
         num_ticks:int = 1,
-        counter:int = 0,
-        max_executions:int=5400,
+        directory:str = "logs/random",
+        tick_delay:float = 0,
     ):
-    # Print
-    print(f"{counter+1}/{max_executions}: Running random domain with seed {seed}, vars {num_vars}, connectivity {cm_connectivity}, leaves {num_leaves}, top_ratio {top_ratio}, internal_ratio {internal_ratio}, intervention {itervention}, run_name {run_name}")
-
     # Generate a random domain
     board, tree = random_domain.random_domain(
         num_vars=num_vars,
@@ -31,69 +42,143 @@ def run(
     )
 
     # Intervention
-    if itervention is not None:
+    if intervention is not None:
         board.state.flip(intervention)
 
     # Logger
-    filename = f"logs/random/random_{run_name}_seed_{seed}_vars_{num_vars}_connectivity_{cm_connectivity}_leaves_{num_leaves}"
+    filename = f"{directory}/{log_name(run_name,seed,num_vars,cm_connectivity,num_leaves)}"
     logger = Logger(tree=tree, filename=filename, log_env=False)
     tree.visitors.append(logger)
 
     # Run the tree
-    random_domain.run(tree=tree, display_tree=False, num_ticks=num_ticks)
+    random_domain.run(tree=tree, display_tree=False, num_ticks=num_ticks, tick_delay=tick_delay)
 
-    # Increment counter
-    counter += 1
-    return counter
+def log_name(run_name:str,seed:int,num_vars:int,cm_connectivity:float,num_leaves:int) -> str:
+    return f"random_{run_name}_seed_{seed}_vars_{num_vars}_connectivity_{cm_connectivity}_leaves_{num_leaves}"
+
+'''
+SWEEP
+'''
+def grid_jobs(grid:dict,directory:str) -> list[dict]:
+    '''
+    Arguments of run for every execution in a grid, in the order of the original nested loops
+    '''
+    jobs = []
+    for seed in grid["seeds"]:
+        for num_vars in grid["num_vars"]:
+            for cm_connectivity in grid["cm_connectivity"]:
+                for num_leaves in grid["num_leaves"]:
+                    common = {
+                        "seed":seed,
+                        "num_vars":num_vars,
+                        "cm_connectivity":cm_connectivity,
+                        "num_leaves":num_leaves,
+                        "top_ratio":grid["top_ratio"],
+                        "internal_ratio":grid["internal_ratio"],
+                        "num_ticks":grid["num_ticks"],
+                        "directory":directory,
+                    }
 
-if __name__ == "__main__":
-    # Set parameters for random CMs and BTs
-    num_seeds = 10
-    seed_set = list(range(num_seeds))
-    num_vars_set = [4,8,12]
-    cm_connectivity_set = [0,0.25,0.5,0.75,1]
-    top_ratio = 0.5
-    internal_ratio = 0.25
-    num_leaves_set = [2,4,8]
-    num_ticks = 1
-
-    # Counter
-    counter = 0
-    max_executions = int(num_seeds * len(cm_connectivity_set) * len(num_leaves_set) * (top_ratio*sum(num_vars_set) + len(num_vars_set)))
-
-    # Execution
-    for seed in seed_set:
-        for num_vars in num_vars_set:
-            for cm_connectivity in cm_connectivity_set:
-                for num_leaves  in num_leaves_set:
                     # Default run
-                    counter = run(
-                        seed=seed,
-                        num_vars=num_vars,
-                        cm_connectivity=cm_connectivity,
-                        num_leaves=num_leaves,
-                        top_ratio=top_ratio,
-                        internal_ratio=internal_ratio,
-                        run_name="default",
-                        counter=counter,
-                        max_executions=max_executions,
-                    )
-
-                    num_tops = int(round(top_ratio * num_vars))
+                    jobs.append(dict(common,run_name="default"))
+
+                    # Run with intervention on each top variable
+                    num_tops = int(round(grid["top_ratio"] * num_vars))
                     for var_index in range(num_tops):
-                        # Run with intervention on each top variable
                         intervention = f"T{var_index+1}"
-                        counter = run(
-                            seed=seed,
-                            num_vars=num_vars,
-                            cm_connectivity=cm_connectivity,
-                            num_leaves=num_leaves,
-                            top_ratio=top_ratio,
-                            internal_ratio=internal_ratio,
-                            itervention=intervention,
-                            run_name=f"T{var_index+1}",
-                            num_ticks=num_ticks,
-                            counter=counter,
-                            max_executions=max_executions,
-                        )
+                        jobs.append(dict(common,intervention=intervention,run_name=intervention))
+    return jobs
+
+def job_name(job:dict) -> str:
+    return log_name(job["run_name"],job["seed"],job["num_vars"],job["cm_connectivity"],job["num_leaves"])
+
+def run_job(job:dict) -> dict:
+    '''
+    Run a job in a worker, returning its status record rather than raising so one failure doesn't stop the sweep
+    '''
+    start = time.perf_counter()
+    try:
+        run(**job)
+        status = {"status":"done"}
+    except Exception:
+        status = {"status":"failed","error":traceback.format_exc()}
+    return dict(status,job=job_name(job),runtime=time.perf_counter()-start)
+
+def read_status(filepath:str) -> dict[str,dict]:
+    # Latest status record of every job, ignoring a partially written last line
+    statuses = {}
+    if not os.path.exists(filepath):
+        return statuses
+    with open(filepath, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            statuses[record["job"]] = record
+    return statuses
+
+if __name__ == "__main__":
+    '''
+    Parse Arguments
+    '''
+    parser = argparse.ArgumentParser(description="Run the random domain executions of a sweep in parallel")
+    parser.add_argument('--config', type=str, default="random_tests.json")
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--skip_existing', action='store_true', help="Also skip jobs without a status whose log already exists")
+    parser.add_argument('--rerun_failed', action='store_true', help="Run jobs that failed in a previous sweep again")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        config = json.load(file)
+    directory = config["directory"]
+    os.makedirs(directory, exist_ok=True)
+
+    '''
+    Jobs
+    '''
+    jobs = []
+    for grid in config["grids"]:
+        jobs += grid_jobs(grid,directory)
+
+    status_file = f"{directory}/{config.get('status_file','random_tests_status.jsonl')}"
+    statuses = read_status(status_file)
+    pending = []
+    for job in jobs:
+        name = job_name(job)
+        log_exists = os.path.exists(f"{directory}/{name}.json")
+        status = statuses.get(name,{}).get("status")
+        if status == "done" and log_exists:
+            continue
+        if status == "failed" and not args.rerun_failed:
+            continue
+        if status is None and log_exists and args.skip_existing:
+            continue
+        pending.append(job)
+    print(f"{len(jobs)} jobs, {len(jobs)-len(pending)} already finished, {len(pending)} to run on {args.num_workers} workers")
+
+    '''
+    Execution
+    '''
+    start = time.perf_counter()
+    num_failed = 0
+    with open(status_file, 'a') as status_log, ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        # Start on a new line if the last sweep was stopped while writing a record
+        if status_log.tell() > 0:
+            with open(status_file, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    status_log.write("\n")
+
+        futures = [executor.submit(run_job,job) for job in pending]
+        for counter,future in enumerate(as_completed(futures)):
+            record = future.result()
+            status_log.write(json.dumps(record) + "\n")
+            status_log.flush()
+            if record["status"] == "failed":
+                num_failed += 1
+                print(f"{counter+1}/{len(pending)}: {record['job']} failed\n{record['error']}")
+            else:
+                print(f"{counter+1}/{len(pending)}: {record['job']} done in {record['runtime']:.2f}s")
 
+    print(f"Finished {len(pending)-num_failed}/{len(pending)} jobs in {time.perf_counter()-start:.1f}s")